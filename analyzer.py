@@ -1,40 +1,29 @@
 import asyncio
-from openai import AsyncOpenAI
-from config import MODEL_NAME
+import importlib.util
+import json
+import math
+import os
+import unicodedata
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from cache import ResultCache
+from config import BACKEND_LOCAL, BACKEND_OPENAI, ConfigManager, MODEL_NAME, MODERATION_BATCH_SIZE, MODERATION_MODEL, PROMPT_VERSION
+from metrics import RunMetrics
+from prefilter import Prefilter
+from scheduler import RequestScheduler, estimate_tokens, is_input_error
 
+if TYPE_CHECKING:
+    # openai and numpy are imported on first use to keep startup fast
+    from openai import AsyncOpenAI
+    from local_model import LocalBackend
+    from neardup import NearDuplicateIndex
 
-class TextAnalyzer:
-    """Perform moderation requests and score text aggressiveness."""
+# rough upper bound of completion tokens for a "スコア/理由" reply
+REPLY_TOKENS = 100
+# alternatives requested per token in score-only mode (API maximum is 20)
+TOP_LOGPROBS = 10
 
-    def __init__(self, client: AsyncOpenAI):
-        """Store an AsyncOpenAI client for API calls."""
-        self.client = client
-
-    async def moderate_text(self, text: str, max_retries: int = 3):
-        """Return OpenAI moderation results for ``text``."""
-        for _ in range(max_retries):
-            try:
-                resp = await self.client.moderations.create(
-                    input=text,
-                    model="omni-moderation-latest",
-                )
-                cats = resp.results[0].categories
-                scores = resp.results[0].category_scores
-                return cats, scores
-            except Exception:
-                await asyncio.sleep(1)
-        return None, None
-
-    async def get_aggressiveness_score(
-        self,
-        text: str,
-        temperature: float = 1.0,
-        top_p: float = 0.9,
-        max_retries: int = 3,
-    ):
-        """Return a tuple ``(score, reason)`` describing aggression level."""
-        prompt = f"""
-あなたソーシャルメディアの投稿を分析し、その攻撃性を評価する専門家です。
+RUBRIC = """あなたソーシャルメディアの投稿を分析し、その攻撃性を評価する専門家です。
 以下の評価基準と例を参考に、与えられた文章の攻撃性スコアを0から9の整数で決定し、
 その理由を40〜60文字で簡潔に説明してください。
 
@@ -59,7 +48,41 @@ class TextAnalyzer:
 - 文章: "あいつのせいで全部台無しだ。絶対に許さない。"
 - スコア: 8
 - 理由: 特定の個人への強い敵意と攻撃的な言葉が明確に含まれているため。
----
+---"""
+
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "aggressiveness_scores",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "score": {"type": "integer"},
+                            "reason": {"type": "string"},
+                        },
+                        "required": ["id", "score", "reason"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def build_prompt(text) -> str:
+    """Return the single-post aggressiveness prompt for ``text``."""
+    return f"""
+{RUBRIC}
 
 # 分析対象の文章:
 {text}
@@ -68,9 +91,527 @@ class TextAnalyzer:
 スコア: [0-9の整数]
 理由: [40-60文字での具体的な理由]
 """
+
+
+def build_score_only_prompt(text) -> str:
+    """Return a prompt asking for the score of ``text`` as a single digit."""
+    return f"""
+{RUBRIC}
+
+# 分析対象の文章:
+{text}
+
+# 回答形式:
+0-9の整数1文字のみで回答してください。理由は不要です。
+"""
+
+
+def build_reason_prompt(text, score: int) -> str:
+    """Return a prompt asking why ``text`` deserves the already chosen ``score``."""
+    return f"""
+{RUBRIC}
+
+# 分析対象の文章:
+{text}
+
+# 評価済みのスコア:
+{score}
+
+# 回答形式:
+このスコアを変更せず、その根拠のみを回答してください。
+理由: [40-60文字での具体的な理由]
+"""
+
+
+def moderation_input(text) -> str:
+    """Return ``text`` as a string the moderation endpoint accepts.
+
+    Empty spreadsheet cells arrive as ``None`` or NaN, which cannot be
+    serialized to JSON and would fail the whole request; they become ``""``.
+    """
+    if text is None or (isinstance(text, float) and math.isnan(text)):
+        return ""
+    return str(text)
+
+
+def digit_distribution(top_logprobs) -> dict:
+    """Return normalized probabilities of the digits ``0``-``9`` in ``top_logprobs``."""
+    probs = {}
+    for entry in top_logprobs:
+        token = unicodedata.normalize("NFKC", entry.token).strip()
+        if len(token) == 1 and token.isdigit():
+            probs[int(token)] = probs.get(int(token), 0.0) + math.exp(entry.logprob)
+    total = sum(probs.values())
+    return {digit: p / total for digit, p in probs.items()} if total else {}
+
+
+def build_batch_prompt(texts: list) -> str:
+    """Return a prompt asking for the scores of all ``texts`` at once."""
+    posts = json.dumps(
+        [{"id": i, "text": "" if text is None else str(text)} for i, text in enumerate(texts)],
+        ensure_ascii=False,
+    )
+    return f"""
+{RUBRIC}
+
+# 分析対象の文章 (JSON配列):
+{posts}
+
+# 回答形式:
+各文章を個別に評価し、results 配列に文章ごとに1件ずつ
+id (入力と同じ値)、score (0-9の整数)、reason (40-60文字での具体的な理由) を返してください。
+"""
+
+
+def _as_dict(obj) -> dict:
+    """Return the fields of an API result object as a plain ``dict``."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return dict(vars(obj))
+
+
+def _category_key(name: str) -> str:
+    """Return the attribute-style key of a moderation category name."""
+    return name.replace("/", "_").replace("-", "_")
+
+
+class CascadePolicy:
+    """Decide a post from its moderation scores when the outcome is clear.
+
+    Posts where any of ``high_categories`` reaches ``high_threshold`` get
+    ``high_score``; posts whose moderation scores are all at most
+    ``low_threshold`` get ``low_score``. Everything in between still goes
+    to the chat model.
+    """
+
+    def __init__(
+        self,
+        high_categories=("hate/threatening", "violence"),
+        high_threshold: float = 0.95,
+        high_score: int = 9,
+        low_threshold: float = 0.01,
+        low_score: int = 0,
+    ):
+        """Store the thresholds of the policy."""
+        self.high_categories = list(high_categories)
+        self.high_threshold = high_threshold
+        self.high_score = high_score
+        self.low_threshold = low_threshold
+        self.low_score = low_score
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "CascadePolicy":
+        """Create a policy from the ``cascade`` section of the config."""
+        return cls(
+            settings["high_categories"],
+            settings["high_threshold"],
+            settings["high_score"],
+            settings["low_threshold"],
+            settings["low_score"],
+        )
+
+    def decide(self, scores):
+        """Return ``(score, reason, decided_by)`` or ``None`` if undecided.
+
+        ``scores`` is the ``category_scores`` object of a moderation result.
+        """
+        values = {_category_key(k): v for k, v in _as_dict(scores).items() if v is not None}
+        for name in self.high_categories:
+            value = values.get(_category_key(name), 0.0)
+            if value >= self.high_threshold:
+                reason = f"モデレーションで{name}のスコアが{value:.2f}と極めて高いため。"
+                return self.high_score, reason, "cascade_high"
+        if values and max(values.values()) <= self.low_threshold:
+            reason = "モデレーションの全カテゴリのスコアが低く、攻撃的な要素が見られないため。"
+            return self.low_score, reason, "cascade_low"
+        return None
+
+
+class TextAnalyzer:
+    """Perform moderation requests and score text aggressiveness."""
+
+    def __init__(
+        self,
+        client: "AsyncOpenAI",
+        cache: ResultCache = None,
+        scheduler: RequestScheduler = None,
+        cascade: CascadePolicy = None,
+        prefilter: Prefilter = None,
+        local_backend: "LocalBackend" = None,
+        near_duplicates: "NearDuplicateIndex" = None,
+    ):
+        """Store an AsyncOpenAI client, an optional cache and the request scheduler.
+
+        Every API call goes through ``scheduler``, which owns rate limiting
+        and retries of transient errors. With a ``cascade`` policy,
+        moderation runs first and the chat model is only asked about posts
+        the policy leaves undecided. Posts a local ``prefilter`` considers
+        benign are not sent to the API at all. A ``local_backend`` answers
+        posts from a distilled local model and escalates only the posts it
+        is unsure about. With ``near_duplicates``, near-identical posts are
+        clustered and only one post per cluster is analyzed.
+        """
+        self.client = client
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler()
+        self.cascade = cascade
+        self.prefilter = prefilter
+        self.local_backend = local_backend
+        self.near_duplicates = near_duplicates
+
+    def start_metrics(self, prices: dict = None) -> RunMetrics:
+        """Begin collecting the request metrics of a new run and return them."""
+        self.scheduler.metrics = RunMetrics(self.cache, prices)
+        return self.scheduler.metrics
+
+    async def moderate_text(self, text: str, max_retries: int = None):
+        """Return OpenAI moderation results for ``text``."""
+        return (await self.moderate_many([text], 1, max_retries))[0]
+
+    async def moderate_many(
+        self,
+        texts: list,
+        batch_size: int = MODERATION_BATCH_SIZE,
+        max_retries: int = None,
+    ) -> list:
+        """Return a ``(categories, scores)`` tuple for every item of ``texts``.
+
+        Up to ``batch_size`` texts are sent per request. ``max_retries``
+        overrides the scheduler's retry count. When a request is rejected
+        because of its input the batch is split in half until the offending
+        input is isolated; only that item gets ``(None, None)``. Other
+        failures, such as 429 or 5xx errors after the scheduler's retries,
+        are not split and give the whole batch ``(None, None)``. Texts found
+        in the cache are not sent at all.
+        """
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            if self.cache is not None:
+                keys[i] = ResultCache.make_key("moderation", text, model=MODERATION_MODEL)
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    results[i] = (
+                        SimpleNamespace(**cached["categories"]),
+                        SimpleNamespace(**cached["category_scores"]),
+                    )
+                    continue
+            pending.append(i)
+
+        for start in range(0, len(pending), batch_size):
+            indices = pending[start:start + batch_size]
+            try:
+                batch = await self._moderate_batch([texts[i] for i in indices], max_retries)
+            except Exception:
+                # already counted as a failure by the scheduler
+                batch = [(None, None)] * len(indices)
+            for i, (cats, scores) in zip(indices, batch):
+                results[i] = (cats, scores)
+                if self.cache is not None and cats is not None:
+                    self.cache.put(keys[i], {
+                        "categories": _as_dict(cats),
+                        "category_scores": _as_dict(scores),
+                    })
+        return results
+
+    async def _moderate_batch(self, texts: list, max_retries: int) -> list:
+        """Moderate one batch, bisecting it when its input is rejected."""
+        results = await self._create_moderation(texts, max_retries)
+        if results is not None:
+            return results
+        if len(texts) == 1:
+            return [(None, None)]
+        mid = len(texts) // 2
+        left = await self._moderate_batch(texts[:mid], max_retries)
+        right = await self._moderate_batch(texts[mid:], max_retries)
+        return left + right
+
+    async def _create_moderation(self, texts: list, max_retries: int):
+        """Send one moderation request and return per-input results.
+
+        Returns ``None`` when the batch should be bisected: the request was
+        rejected because of its input or the reply did not match it. Other
+        errors are raised.
+        """
+        inputs = [moderation_input(text) for text in texts]
+        try:
+            resp = await self.scheduler.call(
+                "moderations",
+                lambda: self.client.moderations.with_raw_response.create(
+                    input=inputs,
+                    model=MODERATION_MODEL,
+                ),
+                tokens=sum(estimate_tokens(text) for text in texts),
+                max_retries=max_retries,
+            )
+        except Exception as e:
+            if is_input_error(e):
+                return None
+            raise
+        if len(resp.results) != len(texts):
+            self.scheduler.metrics.record_parse_failure("moderations")
+            return None
+        return [(r.categories, r.category_scores) for r in resp.results]
+
+    async def get_aggressiveness_score(
+        self,
+        text: str,
+        temperature: float = 1.0,
+        top_p: float = 0.9,
+        max_retries: int = 3,
+    ):
+        """Return a tuple ``(score, reason)`` describing aggression level.
+
+        API errors are retried by the scheduler; ``max_retries`` bounds how
+        often the request is repeated when the reply cannot be parsed.
+        """
+        key = None
+        if self.cache is not None:
+            key = ResultCache.make_key(
+                "aggressiveness",
+                text,
+                model=MODEL_NAME,
+                prompt=PROMPT_VERSION,
+                temperature=temperature,
+                top_p=top_p,
+            )
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached[0], cached[1]
+        prompt = build_prompt(text)
+        tokens = estimate_tokens(prompt) + REPLY_TOKENS
+        for _ in range(max_retries):
+            try:
+                resp = await self.scheduler.call(
+                    "chat",
+                    lambda: self.client.chat.completions.with_raw_response.create(
+                        model=MODEL_NAME,
+                        messages=[
+                            {"role": "system", "content": "You analyze text and rate aggressiveness."},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=temperature,
+                        top_p=top_p,
+                    ),
+                    tokens=tokens,
+                )
+            except Exception:
+                return None, None
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                self.scheduler.endpoint("chat").tokens.adjust(usage.total_tokens - tokens)
+            content = (resp.choices[0].message.content or "").strip()
+            score = None
+            reason = None
+            for line in content.split("\n"):
+                if line.startswith("スコア"):
+                    val = line.split(":", 1)[1].strip()
+                    if val.isdigit():
+                        score = int(val)
+                elif line.startswith("理由"):
+                    reason = line.split(":", 1)[1].strip()
+            if score is not None and reason:
+                if key is not None:
+                    self.cache.put(key, [score, reason])
+                return score, reason
+            self.scheduler.metrics.record_parse_failure("chat")
+        return None, None
+
+    async def get_aggressiveness_score_fast(
+        self,
+        text: str,
+        temperature: float = 1.0,
+        top_p: float = 0.9,
+        max_retries: int = 3,
+    ):
+        """Return ``(score, expected)`` from a single-token reply.
+
+        The model answers with one digit (``max_tokens=1``) and the top
+        logprobs of that token are read instead of parsing free text.
+        ``score`` is the most likely digit and ``expected`` the
+        probability-weighted mean score as a ``float``. No reason is
+        generated.
+        """
+        key = None
+        if self.cache is not None:
+            key = ResultCache.make_key(
+                "aggressiveness",
+                text,
+                model=MODEL_NAME,
+                prompt=f"{PROMPT_VERSION}/score-only",
+                temperature=temperature,
+                top_p=top_p,
+            )
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached[0], cached[1]
+        prompt = build_score_only_prompt(text)
+        tokens = estimate_tokens(prompt) + 1
         for _ in range(max_retries):
             try:
-                resp = await self.client.chat.completions.create(
+                resp = await self.scheduler.call(
+                    "chat",
+                    lambda: self.client.chat.completions.with_raw_response.create(
+                        model=MODEL_NAME,
+                        messages=[
+                            {"role": "system", "content": "You analyze text and rate aggressiveness."},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=temperature,
+                        top_p=top_p,
+                        max_tokens=1,
+                        logprobs=True,
+                        top_logprobs=TOP_LOGPROBS,
+                    ),
+                    tokens=tokens,
+                )
+            except Exception:
+                return None, None
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                self.scheduler.endpoint("chat").tokens.adjust(usage.total_tokens - tokens)
+            choice = resp.choices[0]
+            logprobs = getattr(choice, "logprobs", None)
+            probs = {}
+            if logprobs is not None and logprobs.content:
+                probs = digit_distribution(logprobs.content[0].top_logprobs)
+            if not probs:
+                content = unicodedata.normalize("NFKC", choice.message.content or "").strip()
+                if len(content) == 1 and content.isdigit():
+                    probs = {int(content): 1.0}
+            if probs:
+                score = max(probs, key=probs.get)
+                expected = sum(digit * p for digit, p in probs.items())
+                if key is not None:
+                    self.cache.put(key, [score, expected])
+                return score, expected
+            self.scheduler.metrics.record_parse_failure("chat")
+        return None, None
+
+    async def get_aggressiveness_reason(
+        self,
+        text: str,
+        score: int,
+        temperature: float = 1.0,
+        top_p: float = 0.9,
+        max_retries: int = 3,
+    ):
+        """Return the reason for the already chosen ``score`` of ``text``, or ``None``.
+
+        Used in score-only mode so that the stored reason justifies the
+        stored score instead of one from a separate scoring call.
+        """
+        key = None
+        if self.cache is not None:
+            key = ResultCache.make_key(
+                "aggressiveness_reason",
+                text,
+                model=MODEL_NAME,
+                prompt=PROMPT_VERSION,
+                score=score,
+                temperature=temperature,
+                top_p=top_p,
+            )
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        prompt = build_reason_prompt(text, score)
+        tokens = estimate_tokens(prompt) + REPLY_TOKENS
+        for _ in range(max_retries):
+            try:
+                resp = await self.scheduler.call(
+                    "chat",
+                    lambda: self.client.chat.completions.with_raw_response.create(
+                        model=MODEL_NAME,
+                        messages=[
+                            {"role": "system", "content": "You analyze text and rate aggressiveness."},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=temperature,
+                        top_p=top_p,
+                    ),
+                    tokens=tokens,
+                )
+            except Exception:
+                return None
+            usage = getattr(resp, "usage", None)
+            if usage is not None:
+                self.scheduler.endpoint("chat").tokens.adjust(usage.total_tokens - tokens)
+            content = (resp.choices[0].message.content or "").strip()
+            reason = None
+            for line in content.split("\n"):
+                if line.startswith("理由"):
+                    reason = line.split(":", 1)[1].strip()
+            if reason:
+                if key is not None:
+                    self.cache.put(key, reason)
+                return reason
+            self.scheduler.metrics.record_parse_failure("chat")
+        return None
+
+    async def score_many(
+        self,
+        texts: list,
+        temperature: float = 1.0,
+        top_p: float = 0.9,
+    ) -> list:
+        """Return ``(score, reason)`` for every item of ``texts`` using one request.
+
+        All posts share one rubric in a single chat completion whose reply
+        is constrained to a JSON schema with an id, score and reason per
+        post. Items that are missing or invalid in the reply fall back to
+        ``get_aggressiveness_score``.
+        """
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            if self.cache is not None:
+                keys[i] = ResultCache.make_key(
+                    "aggressiveness",
+                    text,
+                    model=MODEL_NAME,
+                    prompt=f"{PROMPT_VERSION}/batch",
+                    temperature=temperature,
+                    top_p=top_p,
+                )
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    results[i] = (cached[0], cached[1])
+                    continue
+            pending.append(i)
+
+        if pending:
+            replies = await self._score_batch([texts[i] for i in pending], temperature, top_p)
+            for i, reply in zip(pending, replies):
+                if reply is None:
+                    continue
+                results[i] = reply
+                if self.cache is not None:
+                    self.cache.put(keys[i], list(reply))
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        fallback = await asyncio.gather(
+            *(self.get_aggressiveness_score(texts[i], temperature, top_p) for i in missing)
+        )
+        for i, result in zip(missing, fallback):
+            results[i] = result
+        return results
+
+    async def _score_batch(self, texts: list, temperature: float, top_p: float) -> list:
+        """Send one batched scoring request and return validated replies.
+
+        Returns a list aligned with ``texts`` holding ``(score, reason)`` or
+        ``None`` for items the reply did not cover correctly.
+        """
+        prompt = build_batch_prompt(texts)
+        tokens = estimate_tokens(prompt) + REPLY_TOKENS * len(texts)
+        replies = [None] * len(texts)
+        try:
+            resp = await self.scheduler.call(
+                "chat",
+                lambda: self.client.chat.completions.with_raw_response.create(
                     model=MODEL_NAME,
                     messages=[
                         {"role": "system", "content": "You analyze text and rate aggressiveness."},
@@ -78,19 +619,102 @@ class TextAnalyzer:
                     ],
                     temperature=temperature,
                     top_p=top_p,
-                )
-                content = resp.choices[0].message.content.strip()
-                score = None
-                reason = None
-                for line in content.split("\n"):
-                    if line.startswith("スコア"):
-                        val = line.split(":", 1)[1].strip()
-                        if val.isdigit():
-                            score = int(val)
-                    elif line.startswith("理由"):
-                        reason = line.split(":", 1)[1].strip()
-                if score is not None and reason:
-                    return score, reason
-            except Exception:
-                await asyncio.sleep(1)
-        return None, None
+                    response_format=BATCH_RESPONSE_FORMAT,
+                ),
+                tokens=tokens,
+            )
+        except Exception:
+            return replies
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            self.scheduler.endpoint("chat").tokens.adjust(usage.total_tokens - tokens)
+        try:
+            items = json.loads(resp.choices[0].message.content or "")["results"]
+        except (ValueError, KeyError, TypeError):
+            self.scheduler.metrics.record_parse_failure("chat", len(texts))
+            return replies
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("id")
+            score = item.get("score")
+            reason = item.get("reason")
+            if (
+                isinstance(index, int) and 0 <= index < len(texts) and replies[index] is None
+                and isinstance(score, int) and not isinstance(score, bool) and 0 <= score <= 9
+                and isinstance(reason, str) and reason.strip()
+            ):
+                replies[index] = (score, reason.strip())
+        missing = replies.count(None)
+        if missing:
+            self.scheduler.metrics.record_parse_failure("chat", missing)
+        return replies
+
+
+def build_client(config: ConfigManager, api_key: str, base_url: str = None) -> "AsyncOpenAI":
+    """Create an ``AsyncOpenAI`` client with the connection pool described by ``config``.
+
+    The pool keeps ``config.get_pool_size()`` connections alive so repeated
+    runs reuse them. HTTP/2 is only used when the ``h2`` package is
+    installed. ``base_url`` overrides the API endpoint (``OPENAI_BASE_URL``
+    is honored otherwise).
+    """
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    settings = config.get_http_settings()
+    size = config.get_pool_size()
+    http2 = settings["http2"] and importlib.util.find_spec("h2") is not None
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+        timeout=httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"]),
+        http2=http2,
+    )
+    # retries are handled by RequestScheduler
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+
+def build_analyzer(config: ConfigManager) -> TextAnalyzer:
+    """Create a ``TextAnalyzer`` with the client and cache described by ``config``."""
+    local_settings = config.get_local_model_settings()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key is None and local_settings["backend"] != BACKEND_LOCAL:
+        raise ValueError("OpenAI APIキーが設定されていません。環境変数 'OPENAI_API_KEY' を設定してください。")
+    client = build_client(config, api_key) if api_key is not None else None
+    cache = None
+    cache_settings = config.get_cache_settings()
+    if cache_settings["enabled"]:
+        cache = ResultCache(
+            cache_settings["path"],
+            cache_settings["max_entries"],
+            cache_settings["max_age_days"],
+        )
+        cache.prune()
+    scheduler = RequestScheduler(config.get_rate_limits(), config.get_max_retries())
+    cascade = None
+    cascade_settings = config.get_cascade_settings()
+    if cascade_settings["enabled"]:
+        cascade = CascadePolicy.from_settings(cascade_settings)
+    prefilter = None
+    prefilter_settings = config.get_prefilter_settings()
+    if prefilter_settings["enabled"]:
+        try:
+            prefilter = Prefilter.from_settings(prefilter_settings)
+        except OSError as e:
+            raise ValueError(f"リスク語リストが見つかりません: {e.filename}") from e
+    local_backend = None
+    if local_settings["backend"] != BACKEND_OPENAI:
+        from local_model import LocalBackend
+
+        local_backend = LocalBackend.from_settings(local_settings)
+    near_duplicates = None
+    neardup_settings = config.get_neardup_settings()
+    if neardup_settings["enabled"]:
+        from neardup import NearDuplicateIndex
+
+        near_duplicates = NearDuplicateIndex.from_settings(neardup_settings)
+    return TextAnalyzer(client, cache, scheduler, cascade, prefilter, local_backend, near_duplicates)
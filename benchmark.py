@@ -0,0 +1,146 @@
+"""Offline throughput benchmark against the local mock API.
+
+Drives ``TextAnalyzer`` and ``analyze_rows`` (the pipeline behind the GUI
+and CLI) over synthetic datasets and prints rows/sec, tail latencies and
+memory per dataset size::
+
+    python benchmark.py --rows 1000,10000,100000 --concurrency 16 --chat-latency-ms 50
+
+No API key or network access is needed.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from analyzer import TextAnalyzer, build_client
+from config import SCORE_MODE_FULL, SCORE_MODE_SCORE_ONLY, ConfigManager
+from mock_server import add_server_arguments, server_from_args
+from pipeline import AnalysisOptions, analyze_rows
+from scheduler import RequestScheduler
+
+WORDS = ["今日", "映画", "最悪", "最高", "仕事", "電車", "遅延", "ありがとう", "許さない", "楽しみ",
+         "新製品", "応援", "時間の無駄", "あいつ", "ラーメン", "美味しい", "うるさい", "バカ", "天気", "友達"]
+
+
+def synthetic_posts(rows: int, duplicate_ratio: float = 0.2, seed: int = 0) -> list:
+    """Return ``rows`` short Japanese posts, ``duplicate_ratio`` of them repeats."""
+    rng = random.Random(seed)
+    posts = []
+    for i in range(rows):
+        if posts and rng.random() < duplicate_ratio:
+            posts.append(rng.choice(posts))
+        else:
+            posts.append("、".join(rng.choices(WORDS, k=rng.randint(2, 8))) + f"。#{i}")
+    return posts
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of the process in MiB, or ``None``."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def run_once(analyzer: TextAnalyzer, posts: list, options: AnalysisOptions, trace_memory: bool) -> dict:
+    """Analyze ``posts`` once and return the measured figures."""
+    metrics = analyzer.start_metrics()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    results = await analyze_rows(analyzer, posts, options)
+    elapsed = time.perf_counter() - started
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    metrics.finish(len(posts))
+    await analyzer.client.close()
+    report = metrics.report()
+    failed = results.failed_rows()
+    return {
+        "rows": len(posts),
+        "unique_rows": results.unique_rows,
+        "seconds": elapsed,
+        "rows_per_second": len(posts) / elapsed if elapsed else None,
+        "failed_rows": failed,
+        "peak_rss_mb": peak_rss_mb(),
+        "traced_peak_mb": traced_peak,
+        "endpoints": report["endpoints"],
+    }
+
+
+def format_row(result: dict) -> str:
+    """Return one line of the result table."""
+    chat = result["endpoints"].get("chat", {})
+    moderation = result["endpoints"].get("moderations", {})
+
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else f"{'-':>8}"
+
+    memory = result["traced_peak_mb"] if result["traced_peak_mb"] is not None else result["peak_rss_mb"]
+    return (
+        f"{result['rows']:>9} {result['seconds']:>9.2f} {result['rows_per_second']:>10.1f} "
+        f"{ms(chat.get('latency_p50'))} {ms(chat.get('latency_p95'))} {ms(chat.get('latency_p99'))} "
+        f"{ms(moderation.get('latency_p99'))} {sum(chat.get('retries', {}).values()):>7} "
+        f"{result['failed_rows']:>6} {memory if memory is not None else float('nan'):>9.1f}"
+    )
+
+
+def main(argv=None) -> int:
+    """Run the benchmark for every requested dataset size."""
+    parser = argparse.ArgumentParser(description="モックAPIを使ったスループット計測")
+    parser.add_argument("--rows", default="1000,10000", help="comma-separated dataset sizes (up to 1000000)")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of repeated posts")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=32, help="moderation batch size")
+    parser.add_argument("--score-batch-size", type=int, default=1)
+    parser.add_argument("--score-only", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace Python allocations (slower)")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = server_from_args(args)
+    base_url = server.start_in_thread()
+    config = ConfigManager()
+    config.set_concurrency(args.concurrency)
+    options = AnalysisOptions(
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        score_batch_size=args.score_batch_size,
+        score_mode=SCORE_MODE_SCORE_ONLY if args.score_only else SCORE_MODE_FULL,
+    )
+    print(f"mock API {base_url}  concurrency {args.concurrency}  "
+          f"chat {args.chat_latency_ms}ms  moderation {args.moderation_latency_ms}ms  "
+          f"429 {args.rate_429:.1%}  5xx {args.rate_5xx:.1%}")
+    print(f"{'rows':>9} {'seconds':>9} {'rows/s':>10} {'chat p50':>8} {'chat p95':>8} {'chat p99':>8} "
+          f"{'mod p99':>8} {'retries':>7} {'failed':>6} {'mem MiB':>9}")
+    results = []
+    try:
+        for rows in (int(value) for value in args.rows.split(",")):
+            analyzer = TextAnalyzer(
+                build_client(config, "sk-benchmark", base_url),
+                scheduler=RequestScheduler(base_delay=0.05),
+            )
+            posts = synthetic_posts(rows, args.duplicates, args.seed)
+            result = asyncio.run(run_once(analyzer, posts, options, args.tracemalloc))
+            results.append(result)
+            print(format_row(result), flush=True)
+    finally:
+        server.stop()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
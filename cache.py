@@ -0,0 +1,103 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from config import CACHE_FILE, CACHE_MAX_AGE_DAYS, CACHE_MAX_ENTRIES
+
+
+def normalize_text(text) -> str:
+    """Return ``text`` NFKC-normalized with runs of whitespace collapsed."""
+    if text is None:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
+
+
+class ResultCache:
+    """Persistent content-addressed store for API results.
+
+    Entries live in an SQLite database in WAL mode so lookups stay cheap
+    while results are written from the analysis loop.
+    """
+
+    def __init__(
+        self,
+        path: str = CACHE_FILE,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_age_days: float = CACHE_MAX_AGE_DAYS,
+    ):
+        """Open (or create) the cache database at ``path``."""
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+
+    @staticmethod
+    def make_key(kind: str, text, **params) -> str:
+        """Return the cache key for ``text`` analyzed with ``params``."""
+        payload = json.dumps([kind, normalize_text(text), params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached value for ``key`` or ``None``."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value):
+        """Store a JSON-serializable ``value`` under ``key``."""
+        data = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                (key, data, time.time()),
+            )
+
+    def prune(self) -> int:
+        """Evict expired entries and trim to ``max_entries``.
+
+        Returns
+        -------
+        int
+            Number of deleted entries.
+        """
+        deleted = 0
+        with self.lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                deleted += self.conn.execute("DELETE FROM results WHERE created < ?", (cutoff,)).rowcount
+            if self.max_entries:
+                count = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                excess = count - self.max_entries
+                if excess > 0:
+                    deleted += self.conn.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY created LIMIT ?)",
+                        (excess,),
+                    ).rowcount
+        return deleted
+
+    def stats_text(self) -> str:
+        """Return a short hit/miss summary for status displays."""
+        return f"キャッシュ ヒット: {self.hits} / ミス: {self.misses}"
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self.lock:
+            self.conn.close()
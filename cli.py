@@ -0,0 +1,408 @@
+"""Headless batch moderation.
+
+Runs the same pipeline and total score as the GUI without importing
+``customtkinter`` or ``tkinter``::
+
+    python cli.py posts.xlsx --column 投稿内容 --output results.xlsx
+
+Input and output formats follow the file extensions (``.xlsx``,
+``.parquet``, ``.csv``, ``.jsonl``); without ``--output`` the results are
+written as Parquet. Several inputs, ``--all-sheets`` or a ``--jobs`` file
+run a job queue that writes one output per file and sheet::
+
+    python cli.py day1.xlsx day2.xlsx --column 投稿内容 --all-sheets --output-dir results
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import TYPE_CHECKING
+
+from analyzer import TextAnalyzer
+from config import BACKEND_HYBRID, BACKEND_LOCAL, BACKEND_OPENAI, CONFIG_FILE, SCORE_MODE_SCORE_ONLY, ConfigManager
+from file_io import DEFAULT_OUTPUT_EXTENSION, STREAM_CHUNK_SIZE, ChunkWriter, check_format, iter_column, read_table, write_table
+from jobs import JOB_FAILED, AnalysisJob, jobs_for_files, run_jobs
+from journal import RunJournal
+from metrics import RunMetrics, report_path
+from pipeline import AnalysisOptions, analyze_rows, analyze_stream
+from prefilter import lexicon_path
+from service import AnalysisService
+from sharding import analyze_sharded
+
+if TYPE_CHECKING:
+    # pandas and numpy are imported on first use to keep startup fast
+    import pandas as pd
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="SNS投稿の攻撃性をバッチ判定します")
+    parser.add_argument("input", nargs="*", help="input files (.xlsx, .parquet, .csv or .jsonl)")
+    parser.add_argument("--column", help="column containing the posts")
+    parser.add_argument("--all-sheets", action="store_true", help="queue every sheet of the input workbooks")
+    parser.add_argument(
+        "--jobs",
+        help='JSON list of jobs: [{"input": ..., "column": ..., "sheet": ..., "output": ...}]',
+    )
+    parser.add_argument("--output-dir", help="directory for the outputs of a job queue")
+    parser.add_argument("-o", "--output", help="output file; the format follows the extension (default: <input>_results.parquet)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="config.json with weights and parameters")
+    parser.add_argument("--weights", help="JSON file overriding the weights from the config")
+    parser.add_argument("--temperature", type=float, help="override the configured temperature")
+    parser.add_argument("--top-p", type=float, help="override the configured top-p")
+    parser.add_argument("--concurrency", type=int, help="override the configured concurrency")
+    parser.add_argument("--batch-size", type=int, help="override the moderation batch size")
+    parser.add_argument("--score-batch-size", type=int, help="posts scored per chat completion")
+    parser.add_argument(
+        "--score-only",
+        action="store_true",
+        help="single-token scores from logprobs; reasons only above --reason-threshold",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="moderate first and skip the chat model for clearly decided posts",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="route posts without lexicon hits to a benign result without API calls",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="analyze one post per cluster of near-identical posts and add a cluster_id column",
+    )
+    parser.add_argument("--similarity", type=float, help="similarity a post needs to join a near-duplicate cluster")
+    parser.add_argument(
+        "--backend",
+        choices=[BACKEND_OPENAI, BACKEND_HYBRID, BACKEND_LOCAL],
+        help="score with OpenAI, the local model, or the local model escalating unsure posts",
+    )
+    parser.add_argument("--reason-threshold", type=int, help="minimum score that gets a reason in --score-only mode")
+    parser.add_argument("--report", help="run report JSON (default: reports/<input>-<time>.json)")
+    parser.add_argument("--prometheus", help="also write the run metrics in Prometheus text format")
+    parser.add_argument("--resume", action="store_true", help="skip rows recorded in the input's journal")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read only the text column in chunks and write results incrementally",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="analyze in this many worker processes (keys from sharding.key_pool in the config)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="rows per chunk in --stream mode")
+    return parser.parse_args(argv)
+
+
+def log(message: str):
+    """Write a progress message to stderr."""
+    print(message, file=sys.stderr, flush=True)
+
+
+def make_progress_printer(interval: float = 1.0):
+    """Return an ``on_progress`` callback that reports throughput to stderr."""
+    started = time.monotonic()
+    last = 0.0
+
+    def on_progress(done, total):
+        nonlocal last
+        now = time.monotonic()
+        if now - last < interval and (total is None or done < total):
+            return
+        last = now
+        elapsed = now - started
+        rate = done / elapsed if elapsed else 0.0
+        if total is None:
+            log(f"{done} rows {rate:.1f} rows/s elapsed {elapsed:.1f}s")
+        else:
+            log(f"{done}/{total} rows ({done / total:.1%}) {rate:.1f} rows/s elapsed {elapsed:.1f}s")
+
+    return on_progress
+
+
+def log_stats(analyzer):
+    """Print cache, prefilter, near-duplicate and local model statistics of ``analyzer``."""
+    if analyzer.cache is not None:
+        log(analyzer.cache.stats_text())
+    if analyzer.prefilter is not None:
+        log(analyzer.prefilter.stats_text())
+    if analyzer.near_duplicates is not None:
+        log(analyzer.near_duplicates.stats_text())
+    if analyzer.local_backend is not None:
+        log(analyzer.local_backend.stats_text())
+
+
+def write_reports(args: argparse.Namespace, config: ConfigManager, metrics: RunMetrics):
+    """Write the JSON run report and, if requested, the Prometheus file."""
+    settings = config.get_metrics_settings()
+    path = args.report or report_path(args.input, settings["report_dir"], ".json")
+    metrics.write_json(path)
+    log(metrics.summary_text())
+    log(f"report: {path}")
+    prometheus = args.prometheus
+    if prometheus is None and settings["prometheus"]:
+        prometheus = os.path.splitext(path)[0] + ".prom"
+    if prometheus:
+        metrics.write_prometheus(prometheus)
+
+
+def open_journal(args: argparse.Namespace, rows: int):
+    """Start the input's journal and return it with the rows it already holds."""
+    journal = RunJournal(RunJournal.path_for(args.input))
+    completed = {}
+    if args.resume and journal.exists():
+        header, completed = journal.load()
+        if header is None or header.get("rows") != rows or header.get("column") != args.column:
+            raise ValueError(f"journal {journal.path} does not match the input")
+    journal.start({"input": args.input, "column": args.column, "rows": rows}, args.resume)
+    return journal, completed
+
+
+def run_sharded(args: argparse.Namespace, config: ConfigManager, df: "pd.DataFrame") -> "pd.DataFrame":
+    """Return ``df`` with results from worker processes according to ``args`` and ``config``."""
+    from scoring import compute_total_score
+
+    metrics = RunMetrics(prices=config.get_metrics_settings()["prices"])
+    texts = df[args.column].tolist()
+    journal, completed = open_journal(args, len(texts))
+    try:
+        results, reports = analyze_sharded(
+            config,
+            texts,
+            AnalysisOptions.from_config(config),
+            make_progress_printer(),
+            journal,
+            completed,
+            metrics,
+        )
+    finally:
+        journal.close()
+    df = results.attach(df)
+    df["total_aggression"] = compute_total_score(df, config.get_weights())
+    log(results.dedup_text())
+    for worker, report in reports.items():
+        chat = report["endpoints"].get("chat", {})
+        log(f"{worker}: chat {chat.get('requests', 0)} requests, retries {chat.get('retries', {})}")
+    metrics.finish(len(texts))
+    write_reports(args, config, metrics)
+    return df
+
+
+async def run(
+    args: argparse.Namespace, config: ConfigManager, analyzer: TextAnalyzer, df: "pd.DataFrame"
+) -> "pd.DataFrame":
+    """Return ``df`` with the results of analyzing it according to ``args`` and ``config``."""
+    from scoring import compute_total_score
+
+    metrics = analyzer.start_metrics(config.get_metrics_settings()["prices"])
+    texts = df[args.column].tolist()
+    journal, completed = open_journal(args, len(texts))
+    try:
+        results = await analyze_rows(
+            analyzer,
+            texts,
+            AnalysisOptions.from_config(config),
+            make_progress_printer(),
+            journal,
+            completed,
+        )
+    finally:
+        journal.close()
+    df = results.attach(df)
+    df["total_aggression"] = compute_total_score(df, config.get_weights())
+    log(results.dedup_text())
+    log_stats(analyzer)
+    metrics.finish(len(texts))
+    write_reports(args, config, metrics)
+    return df
+
+
+async def run_stream(args: argparse.Namespace, config: ConfigManager, analyzer: TextAnalyzer, output: str) -> int:
+    """Stream the text column of ``args.input`` through the analyzer into ``output``.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    import pandas as pd
+
+    from scoring import compute_total_score
+
+    metrics = analyzer.start_metrics(config.get_metrics_settings()["prices"])
+    weights = config.get_weights()
+    options = AnalysisOptions.from_config(config)
+    writer = ChunkWriter(output)
+    try:
+        async for texts, results in analyze_stream(
+            analyzer,
+            iter_column(args.input, args.column, args.chunk_size),
+            options,
+            make_progress_printer(),
+        ):
+            chunk = results.attach(pd.DataFrame({args.column: texts}))
+            if options.score_mode == SCORE_MODE_SCORE_ONLY and "aggressiveness_expected" not in chunk:
+                # the writer keeps the first chunk's columns; a chunk without expected scores must not drop them
+                chunk.insert(chunk.columns.get_loc("decided_by"), "aggressiveness_expected", float("nan"))
+            chunk["total_aggression"] = compute_total_score(chunk, weights)
+            writer.write(chunk)
+    finally:
+        writer.close()
+    log_stats(analyzer)
+    metrics.finish(writer.rows)
+    write_reports(args, config, metrics)
+    return writer.rows
+
+
+def build_jobs(args: argparse.Namespace) -> list:
+    """Return the jobs named by ``--jobs`` or by the input files and ``--all-sheets``."""
+    if args.jobs:
+        with open(args.jobs, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        jobs = [
+            AnalysisJob(entry["input"], entry.get("column", args.column), entry.get("sheet"), entry.get("output"))
+            for entry in entries
+        ]
+    else:
+        jobs = jobs_for_files(args.input, args.column, args.all_sheets)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for job in jobs:
+            job.output_path = os.path.join(args.output_dir, os.path.basename(job.output_path))
+    return jobs
+
+
+async def run_queue(args: argparse.Namespace, config: ConfigManager, analyzer: TextAnalyzer, jobs: list):
+    """Run ``jobs`` on one analyzer and report each job as it finishes."""
+    metrics = analyzer.start_metrics(config.get_metrics_settings()["prices"])
+    printers = {}
+
+    def on_progress(job, done, total):
+        printers.setdefault(id(job), make_progress_printer())(done, total)
+
+    def on_finish(job):
+        if job.state == JOB_FAILED:
+            log(f"{job.label}: failed: {job.error}")
+        else:
+            log(f"{job.label}: wrote {job.output_path} ({job.total} rows, {job.results.dedup_text()})")
+
+    await run_jobs(
+        analyzer,
+        jobs,
+        AnalysisOptions.from_config(config),
+        config.get_weights(),
+        on_progress,
+        on_finish,
+        args.resume,
+    )
+    log_stats(analyzer)
+    metrics.finish(sum(job.total or 0 for job in jobs if job.state != JOB_FAILED))
+    write_reports(args, config, metrics)
+
+
+def main(argv=None) -> int:
+    """Entry point of the command-line tool."""
+    args = parse_args(argv)
+    config = ConfigManager(args.config)
+    if args.weights:
+        with open(args.weights, "r", encoding="utf-8") as f:
+            config.data["weights"] = json.load(f)
+    if args.temperature is not None:
+        config.set_temperature(args.temperature)
+    if args.top_p is not None:
+        config.set_top_p(args.top_p)
+    if args.concurrency is not None:
+        config.set_concurrency(args.concurrency)
+    if args.batch_size is not None:
+        config.set_moderation_batch_size(args.batch_size)
+    if args.score_batch_size is not None:
+        config.set_score_batch_size(args.score_batch_size)
+    if args.score_only:
+        config.set_score_mode(SCORE_MODE_SCORE_ONLY)
+    if args.reason_threshold is not None:
+        config.set_reason_threshold(args.reason_threshold)
+    if args.cascade:
+        config.set_cascade_enabled(True)
+    if args.prefilter:
+        config.set_prefilter_enabled(True)
+    if args.near_duplicates:
+        config.set_neardup_enabled(True)
+    if args.similarity is not None:
+        config.set_neardup_threshold(args.similarity)
+    if args.backend is not None:
+        config.set_backend(args.backend)
+    if args.stream and args.resume:
+        log("--resume cannot be combined with --stream; streamed runs keep no journal")
+        return 2
+    if args.shards is not None:
+        if args.stream:
+            log("--shards cannot be combined with --stream")
+            return 2
+        config.data.setdefault("sharding", {})["workers"] = args.shards
+    prefilter_settings = config.get_prefilter_settings()
+    if prefilter_settings["enabled"] and not os.path.isfile(lexicon_path(prefilter_settings["lexicon"])):
+        log(f"lexicon not found: {lexicon_path(prefilter_settings['lexicon'])}")
+        return 2
+    if args.jobs or len(args.input) > 1 or args.all_sheets:
+        if args.stream or args.shards is not None or args.output:
+            log("--stream, --shards and --output need a single input; use --output-dir for a job queue")
+            return 2
+        try:
+            jobs = build_jobs(args)
+            for job in jobs:
+                check_format(job.input_path)
+                check_format(job.output_path)
+                if job.column is None:
+                    raise ValueError(f"{job.label}: --column または jobs の column を指定してください")
+        except (OSError, ValueError, KeyError) as e:
+            log(str(e))
+            return 2
+        args.input = jobs[0].input_path if jobs else "queue"
+        started = time.monotonic()
+        with AnalysisService(config) as service:
+            service.run(run_queue(args, config, service.analyzer, jobs))
+        failed = sum(job.state == JOB_FAILED for job in jobs)
+        log(f"{len(jobs) - failed}/{len(jobs)} jobs finished in {time.monotonic() - started:.1f}s")
+        return 1 if failed else 0
+    if len(args.input) != 1 or args.column is None:
+        log("an input file and --column are required")
+        return 2
+    args.input = args.input[0]
+    output = args.output or f"{os.path.splitext(args.input)[0]}_results{DEFAULT_OUTPUT_EXTENSION}"
+    try:
+        check_format(args.input)
+        check_format(output)
+    except ValueError as e:
+        log(str(e))
+        return 2
+
+    started = time.monotonic()
+    if args.stream:
+        with AnalysisService(config) as service:
+            rows = service.run(run_stream(args, config, service.analyzer, output))
+        elapsed = time.monotonic() - started
+        log(f"wrote {output}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:.1f} rows/s)")
+        return 0
+
+    df = read_table(args.input)
+    if args.column not in df.columns:
+        log(f"column not found: {args.column}")
+        return 2
+    log(f"loaded {len(df)} rows from {args.input} in {time.monotonic() - started:.1f}s")
+    if args.shards is not None:
+        df = run_sharded(args, config, df)
+    else:
+        with AnalysisService(config) as service:
+            df = service.run(run(args, config, service.analyzer, df))
+    write_table(df, output)
+    elapsed = time.monotonic() - started
+    log(f"wrote {output}: {len(df)} rows in {elapsed:.1f}s ({len(df) / elapsed:.1f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,8 +3,112 @@ import os
 
 CONFIG_FILE = 'config.json'
 MODEL_NAME = "gpt-4.1-mini-2025-04-14"
+MODERATION_MODEL = "omni-moderation-latest"
+MODERATION_BATCH_SIZE = 32
+CATEGORY_NAMES = ["hate", "hate/threatening", "self-harm", "sexual",
+                  "sexual/minors", "violence", "violence/graphic"]
+# posts scored per chat completion; 1 sends one request per post
+DEFAULT_SCORE_BATCH_SIZE = 1
+SCORE_MODE_FULL = "full"
+SCORE_MODE_SCORE_ONLY = "score_only"
+# in score-only mode reasons are generated only from this score upwards
+DEFAULT_REASON_THRESHOLD = 5
+# bump whenever the aggressiveness prompt changes so cached scores are not reused
+PROMPT_VERSION = "1"
+CACHE_FILE = "cache.sqlite3"
+CACHE_MAX_ENTRIES = 1_000_000
+CACHE_MAX_AGE_DAYS = 90
+JOURNAL_DIR = "journals"
+DEFAULT_MAX_RETRIES = 5
+
+# requests/tokens per minute for each endpoint; 0 means unlimited
+DEFAULT_RATE_LIMITS = {
+    "moderations": {"rpm": 0, "tpm": 0},
+    "chat": {"rpm": 0, "tpm": 0},
+}
+
+# moderation-first cascade: rows decided from moderation scores skip the chat model
+DEFAULT_CASCADE_SETTINGS = {
+    "enabled": False,
+    "high_categories": ["hate/threatening", "violence"],
+    "high_threshold": 0.95,
+    "high_score": 9,
+    "low_threshold": 0.01,
+    "low_score": 0,
+}
+
+# local prefilter: posts without lexicon hits that are short or emoji-only skip the API
+DEFAULT_PREFILTER_SETTINGS = {
+    "enabled": False,
+    "lexicon": "lexicon_ja.txt",
+    "max_length": 40,
+}
+
+# near-duplicate clustering: posts whose shingle Jaccard similarity to a
+# cluster representative reaches the threshold reuse its result
+DEFAULT_NEARDUP_SETTINGS = {
+    "enabled": False,
+    "threshold": 0.8,
+    "num_perm": 64,
+    "shingle_size": 3,
+}
+
+# scoring backend: "openai", "local" (distilled model only) or "hybrid"
+# (local model, low-confidence posts escalate to OpenAI)
+BACKEND_OPENAI = "openai"
+BACKEND_LOCAL = "local"
+BACKEND_HYBRID = "hybrid"
+DEFAULT_LOCAL_MODEL_SETTINGS = {
+    "backend": BACKEND_OPENAI,
+    "path": "local_model.npz",
+    "min_confidence": 0.8,
+}
+
+# HTTP connection pool of the shared client; max_connections 0 follows the concurrency
+DEFAULT_HTTP_SETTINGS = {
+    "max_connections": 0,
+    "keepalive_expiry": 60.0,
+    "timeout": 60.0,
+    "connect_timeout": 10.0,
+    "http2": False,
+}
+
+# run reports: JSON always, Prometheus text file optionally;
+# prices are USD per 1M tokens per endpoint, e.g. {"chat": {"prompt": 0.4, "completion": 1.6}}
+DEFAULT_METRICS_SETTINGS = {
+    "report_dir": "reports",
+    "prometheus": False,
+    "prices": {},
+}
+
+# sharded runs: worker processes pull chunks of rows from a shared queue; each
+# key_pool entry names the environment variable holding an API key and may set
+# its own base_url and rate_limits, e.g. {"api_key_env": "OPENAI_API_KEY_2"}
+DEFAULT_SHARDING_SETTINGS = {
+    "workers": 0,
+    "chunk_size": 1000,
+    "key_pool": [],
+}
+
+# HTTP scoring service: concurrent requests are coalesced into batches of up
+# to max_batch_size posts, waiting at most max_wait_ms for a batch to fill
+DEFAULT_SERVER_SETTINGS = {
+    "host": "127.0.0.1",
+    "port": 8090,
+    "max_batch_size": 32,
+    "max_wait_ms": 20,
+    "max_body_bytes": 1_000_000,
+}
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": True,
+    "path": CACHE_FILE,
+    "max_entries": CACHE_MAX_ENTRIES,
+    "max_age_days": CACHE_MAX_AGE_DAYS,
+}
 DEFAULT_TEMPERATURE = 1.0
 DEFAULT_TOP_P = 0.9
+DEFAULT_CONCURRENCY = 8
 
 DEFAULT_WEIGHTS = {
     "hate_score": 0.06,
@@ -38,6 +142,16 @@ class ConfigManager:
                 "weights": DEFAULT_WEIGHTS.copy(),
                 "temperature": DEFAULT_TEMPERATURE,
                 "top_p": DEFAULT_TOP_P,
+                "concurrency": DEFAULT_CONCURRENCY,
+                "moderation_batch_size": MODERATION_BATCH_SIZE,
+                "score_batch_size": DEFAULT_SCORE_BATCH_SIZE,
+                "score_mode": SCORE_MODE_FULL,
+                "reason_threshold": DEFAULT_REASON_THRESHOLD,
+                "cache": DEFAULT_CACHE_SETTINGS.copy(),
+                "cascade": DEFAULT_CASCADE_SETTINGS.copy(),
+                "prefilter": DEFAULT_PREFILTER_SETTINGS.copy(),
+                "rate_limits": {k: v.copy() for k, v in DEFAULT_RATE_LIMITS.items()},
+                "max_retries": DEFAULT_MAX_RETRIES,
             }
 
     def save(self):
@@ -49,6 +163,10 @@ class ConfigManager:
         """Return a weight value from the config."""
         return self.data.get("weights", {}).get(key, DEFAULT_WEIGHTS.get(key, 0.0))
 
+    def get_weights(self) -> dict:
+        """Return every weight, falling back to ``DEFAULT_WEIGHTS`` for missing keys."""
+        return {key: self.get_weight(key) for key in DEFAULT_WEIGHTS}
+
     def set_weight(self, key: str, value: float):
         """Update a weight entry and ensure the section exists."""
         if "weights" not in self.data:
@@ -70,3 +188,135 @@ class ConfigManager:
     def set_top_p(self, value: float):
         """Set and store the top-p value."""
         self.data["top_p"] = value
+
+    def get_concurrency(self) -> int:
+        """Return the number of rows analyzed in parallel."""
+        return int(self.data.get("concurrency", DEFAULT_CONCURRENCY))
+
+    def set_concurrency(self, value: int):
+        """Set and store the concurrency level."""
+        self.data["concurrency"] = value
+
+    def get_moderation_batch_size(self) -> int:
+        """Return how many posts are sent per moderation request."""
+        return int(self.data.get("moderation_batch_size", MODERATION_BATCH_SIZE))
+
+    def set_moderation_batch_size(self, value: int):
+        """Set and store the moderation batch size."""
+        self.data["moderation_batch_size"] = value
+
+    def get_cache_settings(self) -> dict:
+        """Return the result cache settings merged over the defaults."""
+        settings = DEFAULT_CACHE_SETTINGS.copy()
+        settings.update(self.data.get("cache", {}))
+        return settings
+
+    def get_rate_limits(self) -> dict:
+        """Return per-endpoint ``rpm``/``tpm`` limits merged over the defaults."""
+        limits = {k: v.copy() for k, v in DEFAULT_RATE_LIMITS.items()}
+        for name, values in self.data.get("rate_limits", {}).items():
+            limits.setdefault(name, {}).update(values)
+        return limits
+
+    def get_max_retries(self) -> int:
+        """Return how often transient API errors are retried."""
+        return int(self.data.get("max_retries", DEFAULT_MAX_RETRIES))
+
+    def get_score_batch_size(self) -> int:
+        """Return how many posts are scored per chat completion."""
+        return int(self.data.get("score_batch_size", DEFAULT_SCORE_BATCH_SIZE))
+
+    def set_score_batch_size(self, value: int):
+        """Set and store the aggressiveness batch size."""
+        self.data["score_batch_size"] = value
+
+    def get_score_mode(self) -> str:
+        """Return ``"full"`` or ``"score_only"``."""
+        return self.data.get("score_mode", SCORE_MODE_FULL)
+
+    def set_score_mode(self, value: str):
+        """Set and store the aggressiveness scoring mode."""
+        self.data["score_mode"] = value
+
+    def get_reason_threshold(self) -> int:
+        """Return the minimum score for which reasons are generated in score-only mode."""
+        return int(self.data.get("reason_threshold", DEFAULT_REASON_THRESHOLD))
+
+    def set_reason_threshold(self, value: int):
+        """Set and store the reason threshold."""
+        self.data["reason_threshold"] = value
+
+    def get_cascade_settings(self) -> dict:
+        """Return the cascade policy settings merged over the defaults."""
+        settings = DEFAULT_CASCADE_SETTINGS.copy()
+        settings.update(self.data.get("cascade", {}))
+        return settings
+
+    def set_cascade_enabled(self, value: bool):
+        """Enable or disable the moderation-first cascade."""
+        self.data.setdefault("cascade", DEFAULT_CASCADE_SETTINGS.copy())["enabled"] = value
+
+    def get_prefilter_settings(self) -> dict:
+        """Return the local prefilter settings merged over the defaults."""
+        settings = DEFAULT_PREFILTER_SETTINGS.copy()
+        settings.update(self.data.get("prefilter", {}))
+        return settings
+
+    def set_prefilter_enabled(self, value: bool):
+        """Enable or disable the local prefilter."""
+        self.data.setdefault("prefilter", DEFAULT_PREFILTER_SETTINGS.copy())["enabled"] = value
+
+    def get_neardup_settings(self) -> dict:
+        """Return the near-duplicate clustering settings merged over the defaults."""
+        settings = DEFAULT_NEARDUP_SETTINGS.copy()
+        settings.update(self.data.get("near_duplicates", {}))
+        return settings
+
+    def set_neardup_enabled(self, value: bool):
+        """Enable or disable near-duplicate clustering."""
+        self.data.setdefault("near_duplicates", DEFAULT_NEARDUP_SETTINGS.copy())["enabled"] = value
+
+    def set_neardup_threshold(self, value: float):
+        """Set the similarity a post needs to join a near-duplicate cluster."""
+        self.data.setdefault("near_duplicates", DEFAULT_NEARDUP_SETTINGS.copy())["threshold"] = value
+
+    def get_local_model_settings(self) -> dict:
+        """Return the local model settings merged over the defaults."""
+        settings = DEFAULT_LOCAL_MODEL_SETTINGS.copy()
+        settings.update(self.data.get("local_model", {}))
+        return settings
+
+    def set_backend(self, value: str):
+        """Select the scoring backend (``openai``, ``local`` or ``hybrid``)."""
+        self.data.setdefault("local_model", DEFAULT_LOCAL_MODEL_SETTINGS.copy())["backend"] = value
+
+    def get_http_settings(self) -> dict:
+        """Return the HTTP client settings merged over the defaults."""
+        settings = DEFAULT_HTTP_SETTINGS.copy()
+        settings.update(self.data.get("http", {}))
+        return settings
+
+    def get_pool_size(self) -> int:
+        """Return the number of pooled connections for the configured concurrency.
+
+        Every worker can have a moderation and a chat request open at once.
+        """
+        return self.get_http_settings()["max_connections"] or 2 * self.get_concurrency()
+
+    def get_metrics_settings(self) -> dict:
+        """Return the run report settings merged over the defaults."""
+        settings = DEFAULT_METRICS_SETTINGS.copy()
+        settings.update(self.data.get("metrics", {}))
+        return settings
+
+    def get_server_settings(self) -> dict:
+        """Return the HTTP scoring service settings merged over the defaults."""
+        settings = DEFAULT_SERVER_SETTINGS.copy()
+        settings.update(self.data.get("server", {}))
+        return settings
+
+    def get_sharding_settings(self) -> dict:
+        """Return the sharded runner settings merged over the defaults."""
+        settings = DEFAULT_SHARDING_SETTINGS.copy()
+        settings.update(self.data.get("sharding", {}))
+        return settings
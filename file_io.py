@@ -0,0 +1,329 @@
+import json
+import os
+from typing import TYPE_CHECKING
+
+from config import CATEGORY_NAMES
+
+if TYPE_CHECKING:
+    # pandas is imported on first use to keep GUI startup fast
+    import pandas as pd
+
+STREAM_CHUNK_SIZE = 5000
+
+# extension -> label of every supported table format, in file dialog order
+TABLE_FORMATS = {
+    ".xlsx": "Excel",
+    ".parquet": "Parquet",
+    ".csv": "CSV",
+    ".jsonl": "JSON Lines",
+    ".ndjson": "JSON Lines",
+}
+# default format for intermediate and archival output
+DEFAULT_OUTPUT_EXTENSION = ".parquet"
+
+
+def _extension(path: str) -> str:
+    """Return the lower-case extension of ``path``."""
+    return os.path.splitext(path)[1].lower()
+
+
+def file_types(first: str = ".xlsx") -> list:
+    """Return ``filetypes`` for tkinter file dialogs, ``first`` listed first."""
+    patterns = {}
+    for ext, label in TABLE_FORMATS.items():
+        patterns.setdefault(label, []).append(f"*{ext}")
+    labels = sorted(patterns, key=lambda label: label != TABLE_FORMATS[first])
+    supported = " ".join(pattern for label in labels for pattern in patterns[label])
+    return [(f"{label} files", " ".join(patterns[label])) for label in labels] + [("All supported", supported)]
+
+
+def check_format(path: str):
+    """Raise ``ValueError`` if ``path`` cannot be read or written.
+
+    Called before an analysis starts, so an unsupported output path or a
+    missing Parquet engine is reported before any API call is made.
+    """
+    ext = _extension(path)
+    if ext not in TABLE_FORMATS:
+        raise ValueError(f"対応していないファイル形式です: {ext or path}")
+    if ext == ".parquet":
+        _require_pyarrow()
+
+
+def _require_pyarrow():
+    """Import pyarrow, raising ``ValueError`` with install instructions if missing."""
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ValueError("Parquet形式には pyarrow が必要です: pip install pyarrow") from None
+    return pyarrow
+
+
+def sheet_names(path: str) -> list:
+    """Return the sheet names of an Excel workbook, or ``[None]`` for other formats."""
+    check_format(path)
+    if _extension(path) != ".xlsx":
+        return [None]
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def read_columns(path: str, sheet: str = None) -> list:
+    """Return the column names of ``path`` without reading its rows."""
+    check_format(path)
+    ext = _extension(path)
+    if ext == ".xlsx":
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+            header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return [name for name in header if name is not None]
+    if ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+    if ext == ".csv":
+        import pandas as pd
+
+        return list(pd.read_csv(path, nrows=0).columns)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                return list(json.loads(line))
+    return []
+
+
+def read_table(path: str, sheet: str = None) -> "pd.DataFrame":
+    """Read ``path`` into a DataFrame; the format follows its extension.
+
+    Excel files are read from ``sheet``, by default the first one. Parquet
+    files keep the column types they were written with.
+    """
+    import pandas as pd
+
+    check_format(path)
+    ext = _extension(path)
+    if ext == ".xlsx":
+        return pd.read_excel(path, sheet_name=sheet if sheet is not None else 0)
+    if ext == ".parquet":
+        return pd.read_parquet(path, engine="pyarrow")
+    if ext == ".csv":
+        return pd.read_csv(path)
+    return pd.read_json(path, orient="records", lines=True, dtype=False)
+
+
+def typed_results(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Return ``df`` with the result columns converted to nullable typed columns.
+
+    Flags become ``boolean``, category scores ``Float32``, the
+    aggressiveness score ``Int64`` and reasons and labels ``string``, so
+    rows that failed are stored as nulls instead of falling back to
+    object columns. Other object columns, such as the posts, become
+    ``string`` because Parquet needs one type per column.
+    """
+    import pandas as pd
+
+    types = {}
+    for name in CATEGORY_NAMES:
+        types[f"{name}_flag"] = "boolean"
+        types[f"{name}_score"] = "Float32"
+    types.update({
+        "aggressiveness_score": "Int64",
+        "aggressiveness_expected": "Float32",
+        "total_aggression": "Float64",
+        "cluster_id": "Int64",
+        "aggressiveness_reason": "string",
+        "decided_by": "string",
+    })
+    df = df.copy()
+    for column, dtype in types.items():
+        if column in df.columns:
+            values = df[column]
+            if dtype != "boolean" and dtype != "string":
+                values = pd.to_numeric(values, errors="coerce")
+            df[column] = values.astype(dtype)
+    for column in df.columns:
+        if column not in types and df[column].dtype == object:
+            df[column] = df[column].astype("string")
+    return df
+
+
+def _widened(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Return ``df`` with ``float32`` columns widened through their shortest decimal form.
+
+    Text formats would otherwise show ``0.123456`` as ``0.12345600128173828``.
+    Only the writers of text formats pay for the string round trip; missing
+    values become NaN.
+    """
+    import numpy as np
+
+    narrow = [column for column in df.columns if str(df[column].dtype).lower() == "float32"]
+    if not narrow:
+        return df
+    df = df.copy()
+    for column in narrow:
+        values = df[column].to_numpy(dtype=np.float32, na_value=np.nan)
+        df[column] = values.astype(str).astype(np.float64)
+    return df
+
+
+def write_table(df: "pd.DataFrame", path: str):
+    """Write ``df`` to ``path``; the format follows its extension.
+
+    Parquet is written with typed result columns (see ``typed_results``);
+    Excel is meant for handing results over to people.
+    """
+    check_format(path)
+    ext = _extension(path)
+    if ext == ".parquet":
+        typed_results(df).to_parquet(path, engine="pyarrow", index=False)
+    elif ext == ".xlsx":
+        _widened(df).to_excel(path, index=False)
+    elif ext == ".csv":
+        _widened(df).to_csv(path, index=False)
+    else:
+        _widened(df).to_json(path, orient="records", lines=True, force_ascii=False)
+
+
+def iter_column(path: str, column: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield the values of ``column`` in ``path`` as lists of ``chunk_size``.
+
+    Only the selected column is kept in memory. Excel workbooks are read
+    with openpyxl in read-only mode (first sheet), Parquet files in record
+    batches of the one column, CSV files with pandas chunks and JSONL files
+    line by line.
+    """
+    ext = _extension(path)
+    if ext == ".xlsx":
+        yield from _iter_excel_column(path, column, chunk_size)
+    elif ext == ".parquet":
+        yield from _iter_parquet_column(path, column, chunk_size)
+    elif ext == ".csv":
+        import pandas as pd
+
+
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=chunk_size):
+            yield chunk[column].tolist()
+    elif ext in (".jsonl", ".ndjson"):
+        yield from _iter_jsonl_column(path, column, chunk_size)
+    else:
+        raise ValueError(f"ストリーミングに対応していない形式です: {ext}")
+
+
+def _iter_excel_column(path: str, column: str, chunk_size: int):
+    """Yield chunks of ``column`` from the first sheet of an Excel workbook."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        if column not in header:
+            raise KeyError(column)
+        position = header.index(column)
+        chunk = []
+        for row in rows:
+            chunk.append(row[position] if position < len(row) else None)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def _iter_parquet_column(path: str, column: str, chunk_size: int):
+    """Yield chunks of ``column`` from a Parquet file."""
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    if column not in parquet.schema_arrow.names:
+        raise KeyError(column)
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=[column]):
+        yield batch.column(0).to_pylist()
+
+
+def _iter_jsonl_column(path: str, column: str, chunk_size: int):
+    """Yield chunks of ``column`` from a JSON Lines file."""
+    chunk = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(json.loads(line).get(column))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class ChunkWriter:
+    """Append DataFrame chunks to an output file as they become available."""
+
+    def __init__(self, path: str):
+        """Prepare to write to ``path``; the format follows its extension."""
+        self.path = path
+        self.ext = _extension(path)
+        check_format(path)
+        self.rows = 0
+        self.workbook = None
+        self.sheet = None
+        self.parquet = None
+        self.columns = None
+
+    def write(self, df: "pd.DataFrame"):
+        """Append the rows of ``df`` under the columns of the first chunk.
+
+        Columns missing from a later chunk are written empty and extra
+        ones are dropped, so rows never shift under the header.
+        """
+        first = self.rows == 0
+        if self.columns is None:
+            self.columns = list(df.columns)
+        df = df.reindex(columns=self.columns)
+        if self.ext != ".parquet":
+            df = _widened(df)
+        if self.ext == ".parquet":
+            pyarrow = _require_pyarrow()
+            table = pyarrow.Table.from_pandas(typed_results(df), preserve_index=False)
+            if self.parquet is None:
+                self.parquet = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self.parquet.write_table(table.cast(self.parquet.schema))
+        elif self.ext == ".csv":
+            df.to_csv(self.path, mode="w" if first else "a", header=first, index=False)
+        elif self.ext == ".xlsx":
+            if self.workbook is None:
+                from openpyxl import Workbook
+
+                self.workbook = Workbook(write_only=True)
+                self.sheet = self.workbook.create_sheet()
+                self.sheet.append(list(df.columns))
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+                self.sheet.append(list(row))
+        else:
+            with open(self.path, "w" if first else "a", encoding="utf-8") as f:
+                df.to_json(f, orient="records", lines=True, force_ascii=False)
+        self.rows += len(df)
+
+    def close(self):
+        """Finish the output file."""
+        if self.parquet is not None:
+            self.parquet.close()
+            self.parquet = None
+        if self.workbook is not None:
+            self.workbook.save(self.path)
+            self.workbook.close()
+            self.workbook = None
@@ -0,0 +1,143 @@
+"""Queue of analysis jobs over many files and sheets.
+
+Every job reads one sheet of one file, analyzes its text column and
+writes its own output file. Jobs run on one analyzer under one shared
+concurrency limit, and the next job starts while the previous one is
+still finishing, so the API budget stays in use across job boundaries.
+"""
+import asyncio
+import os
+
+from config import DEFAULT_WEIGHTS
+from file_io import DEFAULT_OUTPUT_EXTENSION, read_table, sheet_names, write_table
+from journal import RunJournal
+from pipeline import AnalysisOptions, analyze_rows
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+# jobs analyzed at once; the second one keeps the API busy while the first drains
+JOB_WINDOW = 2
+
+
+def job_output_path(input_path: str, sheet: str = None, extension: str = DEFAULT_OUTPUT_EXTENSION) -> str:
+    """Return ``<input>[_<sheet>]_results<extension>`` next to ``input_path``."""
+    stem = os.path.splitext(input_path)[0]
+    if sheet is not None:
+        stem += "_" + "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in sheet)
+    return f"{stem}_results{extension}"
+
+
+class AnalysisJob:
+    """One sheet of one input file with its text column and output path."""
+
+    def __init__(self, input_path: str, column: str, sheet: str = None, output_path: str = None):
+        """Create a queued job; the output defaults to ``job_output_path``."""
+        self.input_path = input_path
+        self.column = column
+        self.sheet = sheet
+        self.output_path = output_path or job_output_path(input_path, sheet)
+        self.state = JOB_QUEUED
+        self.done = 0
+        self.total = None
+        self.results = None
+        self.error = None
+
+    @property
+    def label(self) -> str:
+        """Return ``file.xlsx [Sheet]`` for progress displays."""
+        name = os.path.basename(self.input_path)
+        return f"{name} [{self.sheet}]" if self.sheet is not None else name
+
+    def journal_path(self) -> str:
+        """Return the journal path of this file and sheet."""
+        key = self.input_path if self.sheet is None else f"{self.input_path}#{self.sheet}"
+        return RunJournal.path_for(key)
+
+
+def jobs_for_files(paths: list, column: str, all_sheets: bool = False, extension: str = DEFAULT_OUTPUT_EXTENSION):
+    """Return one job per file, or per sheet of every workbook with ``all_sheets``."""
+    jobs = []
+    for path in paths:
+        sheets = sheet_names(path) if all_sheets else [None]
+        for sheet in sheets:
+            jobs.append(AnalysisJob(path, column, sheet, job_output_path(path, sheet, extension)))
+    return jobs
+
+
+async def run_jobs(
+    analyzer,
+    jobs: list,
+    options: AnalysisOptions = None,
+    weights: dict = None,
+    on_progress=None,
+    on_finish=None,
+    resume: bool = False,
+    window: int = JOB_WINDOW,
+) -> list:
+    """Run ``jobs`` in order, up to ``window`` at a time, on ``analyzer``.
+
+    All jobs share one limit of ``options.concurrency`` chat requests and
+    the analyzer's rate limits. ``on_progress(job, done, total)`` is called
+    as rows finish and ``on_finish(job)`` when a job is done or failed; a
+    failed job keeps its exception in ``job.error`` and does not stop the
+    queue. With ``resume``, rows in a job's journal are skipped.
+    """
+    options = options or AnalysisOptions()
+    limiter = asyncio.Semaphore(options.concurrency)
+    pending = iter(jobs)
+
+    async def worker():
+        for job in pending:
+            await run_job(analyzer, job, options, weights or DEFAULT_WEIGHTS, limiter, on_progress, resume)
+            if on_finish is not None:
+                on_finish(job)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(window, len(jobs))))))
+    return jobs
+
+
+async def run_job(analyzer, job: AnalysisJob, options: AnalysisOptions, weights: dict, limiter,
+                  on_progress=None, resume: bool = False):
+    """Read, analyze and write one job; errors are stored on the job."""
+    from scoring import compute_total_score
+
+    job.state = JOB_RUNNING
+    job.done = 0
+    job.results = None
+    job.error = None
+
+    def report(done, total):
+        job.done, job.total = done, total
+        if on_progress is not None:
+            on_progress(job, done, total)
+
+    try:
+        df = await asyncio.to_thread(read_table, job.input_path, job.sheet)
+        if job.column not in df.columns:
+            raise ValueError(f"列が見つかりません: {job.column}")
+        texts = df[job.column].tolist()
+        job.total = len(texts)
+        journal = RunJournal(job.journal_path())
+        completed = {}
+        if resume and journal.exists():
+            header, completed = journal.load()
+            if header is None or header.get("rows") != len(texts) or header.get("column") != job.column:
+                raise ValueError(f"ジャーナル {journal.path} が入力と一致しません")
+        header = {"input": job.input_path, "sheet": job.sheet, "column": job.column, "rows": len(texts)}
+        journal.start(header, resume)
+        try:
+            results = await analyze_rows(analyzer, texts, options, report, journal, completed, limiter)
+        finally:
+            journal.close()
+        df = results.attach(df)
+        df["total_aggression"] = compute_total_score(df, weights)
+        await asyncio.to_thread(write_table, df, job.output_path)
+    except Exception as e:
+        job.state = JOB_FAILED
+        job.error = e
+        return
+    job.results = results
+    job.done = job.total
+    job.state = JOB_DONE
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+
+from config import JOURNAL_DIR
+
+
+class RunJournal:
+    """Append-only JSONL log of the rows completed during an analysis run.
+
+    The first line is a header describing the run; every following line
+    holds the result record of one finished row. A run that stops early can
+    be resumed by reloading the completed rows from the journal.
+    """
+
+    def __init__(self, path: str):
+        """Use the journal file at ``path``."""
+        self.path = path
+        self.file = None
+
+    @staticmethod
+    def path_for(input_path: str, directory: str = JOURNAL_DIR) -> str:
+        """Return the journal path used for ``input_path``."""
+        digest = hashlib.sha1(os.path.abspath(input_path).encode("utf-8")).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        return os.path.join(directory, f"{stem}-{digest}.jsonl")
+
+    def exists(self) -> bool:
+        """Return ``True`` if a journal has been written at ``self.path``."""
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Read the journal.
+
+        Returns
+        -------
+        tuple
+            ``(header, completed)`` where ``completed`` maps row index to
+            result record. A truncated last line is ignored.
+        """
+        header = None
+        completed = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if header is None:
+                    header = entry
+                else:
+                    completed[entry.pop("i")] = entry
+        return header, completed
+
+    def start(self, header: dict, resume: bool = False):
+        """Open the journal for writing.
+
+        A new run truncates the file and writes ``header``; a resumed run
+        appends to the existing journal.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if resume and self.exists():
+            self.file = open(self.path, "a", encoding="utf-8")
+            # make sure a line cut off by a crash does not swallow the next record
+            self.file.write("\n")
+        else:
+            self.file = open(self.path, "w", encoding="utf-8")
+            self.file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def append(self, index: int, record: dict):
+        """Record that row ``index`` finished with ``record``."""
+        self.file.write(json.dumps({"i": index, **record}, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        """Push buffered records to disk."""
+        self.file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,315 @@
+"""Local CPU model distilled from saved analysis results.
+
+Train from one or more result files written by the GUI or ``cli.py``::
+
+    python local_model.py results_2024*.xlsx --column 投稿内容 -o local_model.npz
+
+The model hashes character n-grams of the folded text into a fixed number
+of buckets and learns one linear layer on top of them: a softmax over the
+aggressiveness scores 0-9 plus one sigmoid output per moderation category
+score and flag.
+"""
+import argparse
+import sys
+import zlib
+
+import numpy as np
+
+from config import BACKEND_LOCAL, CATEGORY_NAMES, DEFAULT_LOCAL_MODEL_SETTINGS
+from prefilter import fold_text
+
+SCORE_CLASSES = 10
+DEFAULT_FEATURES = 2 ** 18
+DEFAULT_NGRAMS = (1, 3)
+# rows decided by these stages are heuristics, not labels, and are not trained on
+UNTRUSTED_LABELS = ("prefilter", "local", "cascade_high", "cascade_low")
+
+
+def featurize(texts, n_features: int = DEFAULT_FEATURES, ngrams=DEFAULT_NGRAMS):
+    """Return hashed character n-gram features of ``texts``.
+
+    Returns
+    -------
+    tuple
+        ``(indices, values, offsets)``: the bucket and weight of every
+        feature and the position where each row starts. Bucket ``0`` is a
+        bias feature present in every row, so no row is empty.
+    """
+    low, high = ngrams
+    indices = []
+    counts = []
+    offsets = np.empty(len(texts), dtype=np.int64)
+    crc32 = zlib.crc32
+    buckets = n_features - 1
+    for row, text in enumerate(texts):
+        offsets[row] = len(indices)
+        folded = fold_text(text)
+        indices.append(0)
+        start = len(indices)
+        for n in range(low, high + 1):
+            for i in range(len(folded) - n + 1):
+                indices.append(crc32(folded[i:i + n].encode("utf-8")) % buckets + 1)
+        counts.append(len(indices) - start)
+    indices = np.asarray(indices, dtype=np.int64)
+    sizes = np.diff(np.append(offsets, len(indices)))
+    # scale each row to unit length so long posts do not get larger logits
+    norms = 1.0 / np.sqrt(np.maximum(np.asarray(counts, dtype=np.float32), 1.0))
+    values = np.repeat(norms, sizes).astype(np.float32)
+    values[offsets] = 1.0
+    return indices, values, offsets
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """Return row-wise softmax probabilities."""
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def _sigmoid(logits: np.ndarray) -> np.ndarray:
+    """Return element-wise sigmoid values."""
+    return 1.0 / (1.0 + np.exp(-np.clip(logits, -30, 30)))
+
+
+class LocalModel:
+    """Linear model over hashed character n-grams.
+
+    Columns of the weight matrix are the ten aggressiveness score classes,
+    followed by one moderation score and one moderation flag output for
+    every category in ``CATEGORY_NAMES``.
+    """
+
+    def __init__(self, n_features: int = DEFAULT_FEATURES, ngrams=DEFAULT_NGRAMS, weights: np.ndarray = None):
+        """Create an untrained model or wrap trained ``weights``."""
+        self.n_features = n_features
+        self.ngrams = tuple(ngrams)
+        outputs = SCORE_CLASSES + 2 * len(CATEGORY_NAMES)
+        self.weights = weights if weights is not None else np.zeros((n_features, outputs), dtype=np.float32)
+
+    def logits(self, texts) -> np.ndarray:
+        """Return the raw outputs for ``texts``."""
+        indices, values, offsets = featurize(texts, self.n_features, self.ngrams)
+        if not len(offsets):
+            return np.zeros((0, self.weights.shape[1]), dtype=np.float32)
+        return np.add.reduceat(self.weights[indices] * values[:, None], offsets, axis=0)
+
+    def predict(self, texts) -> dict:
+        """Score ``texts`` in bulk.
+
+        Returns
+        -------
+        dict
+            ``score`` (most likely class), ``expected`` (probability-weighted
+            mean), ``confidence`` (probability of ``score``), ``scores`` and
+            ``flags`` (rows x categories).
+        """
+        logits = self.logits(texts)
+        probs = _softmax(logits[:, :SCORE_CLASSES])
+        n = len(CATEGORY_NAMES)
+        return {
+            "score": probs.argmax(axis=1),
+            "expected": probs @ np.arange(SCORE_CLASSES, dtype=np.float32),
+            "confidence": probs.max(axis=1),
+            "scores": _sigmoid(logits[:, SCORE_CLASSES:SCORE_CLASSES + n]),
+            "flags": logits[:, SCORE_CLASSES + n:] > 0,
+        }
+
+    def fit(self, texts, targets: dict, epochs: int = 5, batch_size: int = 256, learning_rate: float = 0.2, seed: int = 0):
+        """Train the model with mini-batch AdaGrad.
+
+        ``targets`` holds ``score`` (int, ``-1`` when unknown), ``scores``
+        and ``flags`` (rows x categories, ``NaN`` when moderation is
+        unknown), as returned by ``load_training_data``.
+        """
+        indices, values, offsets = featurize(texts, self.n_features, self.ngrams)
+        ends = np.append(offsets[1:], len(indices))
+        score = np.asarray(targets["score"])
+        moderation = np.hstack([targets["scores"], targets["flags"]]).astype(np.float32)
+        known = ~np.isnan(moderation)
+        moderation = np.nan_to_num(moderation)
+        squared = np.zeros_like(self.weights)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(offsets))
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                sizes = ends[rows] - offsets[rows]
+                firsts = np.cumsum(sizes) - sizes
+                positions = np.repeat(offsets[rows] - firsts, sizes) + np.arange(sizes.sum())
+                idx = indices[positions]
+                val = values[positions]
+                logits = np.add.reduceat(self.weights[idx] * val[:, None], firsts, axis=0)
+                # softmax and sigmoid cross-entropy share the gradient "prediction - target"
+                grad = np.empty_like(logits)
+                probs = _softmax(logits[:, :SCORE_CLASSES])
+                labelled = score[rows] >= 0
+                probs[labelled, score[rows][labelled]] -= 1.0
+                probs[~labelled] = 0.0
+                grad[:, :SCORE_CLASSES] = probs
+                grad[:, SCORE_CLASSES:] = (_sigmoid(logits[:, SCORE_CLASSES:]) - moderation[rows]) * known[rows]
+                buckets, inverse = np.unique(idx, return_inverse=True)
+                update = np.zeros((len(buckets), self.weights.shape[1]), dtype=np.float32)
+                np.add.at(update, inverse, np.repeat(grad, sizes, axis=0) * val[:, None])
+                squared[buckets] += update ** 2
+                self.weights[buckets] -= learning_rate * update / (np.sqrt(squared[buckets]) + 1e-6)
+        return self
+
+    def save(self, path: str):
+        """Write the model to ``path`` (``.npz``)."""
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            n_features=self.n_features,
+            ngrams=np.asarray(self.ngrams),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LocalModel":
+        """Read a model written by ``save``."""
+        with np.load(path) as data:
+            return cls(int(data["n_features"]), tuple(int(n) for n in data["ngrams"]), data["weights"])
+
+
+class LocalBackend:
+    """Scoring backend that answers from a ``LocalModel`` without API calls.
+
+    ``decide_many`` is the backend interface used by the pipeline: it
+    returns one prediction per text, or ``None`` for texts that must be
+    escalated to the OpenAI backend because the model's confidence is below
+    ``min_confidence``. A ``min_confidence`` of ``0`` answers every text
+    locally.
+    """
+
+    def __init__(self, model: LocalModel, min_confidence: float = 0.0, batch_size: int = 4096):
+        """Wrap ``model`` with the escalation threshold."""
+        self.model = model
+        self.min_confidence = min_confidence
+        self.batch_size = batch_size
+        self.checked = 0
+        self.decided = 0
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "LocalBackend":
+        """Create a backend from the ``local_model`` section of the config."""
+        min_confidence = 0.0 if settings["backend"] == BACKEND_LOCAL else settings["min_confidence"]
+        return cls(LocalModel.load(settings["path"]), min_confidence)
+
+    def decide_many(self, texts: list) -> list:
+        """Return a prediction dict per text, or ``None`` where it escalates."""
+        decisions = []
+        for start in range(0, len(texts), self.batch_size):
+            predicted = self.model.predict(texts[start:start + self.batch_size])
+            for i, confidence in enumerate(predicted["confidence"]):
+                if confidence < self.min_confidence:
+                    decisions.append(None)
+                    continue
+                decisions.append({
+                    "score": int(predicted["score"][i]),
+                    "expected": float(predicted["expected"][i]),
+                    "confidence": float(confidence),
+                    "flags": {name: bool(predicted["flags"][i, j]) for j, name in enumerate(CATEGORY_NAMES)},
+                    "scores": {name: float(predicted["scores"][i, j]) for j, name in enumerate(CATEGORY_NAMES)},
+                })
+        self.checked += len(texts)
+        self.decided += sum(decision is not None for decision in decisions)
+        return decisions
+
+    def stats_text(self) -> str:
+        """Return a short routing summary for status displays."""
+        rate = self.decided / self.checked if self.checked else 0.0
+        return f"ローカルモデル: {self.decided}/{self.checked}件 ({rate:.1%}) API送信 {self.checked - self.decided}件"
+
+
+def load_training_data(paths, column: str):
+    """Read texts and labels from result files of earlier runs.
+
+    Rows are deduplicated by folded text. Rows decided by the prefilter,
+    the cascade or the local model itself are skipped, as are rows whose
+    moderation failed.
+
+    Returns
+    -------
+    tuple
+        ``(texts, targets)`` suitable for ``LocalModel.fit``.
+    """
+    import pandas as pd
+
+    from file_io import read_table
+
+    df = pd.concat([read_table(path) for path in paths], ignore_index=True)
+    if "decided_by" in df.columns:
+        df = df[~df["decided_by"].isin(UNTRUSTED_LABELS)]
+    score_columns = [f"{name}_score" for name in CATEGORY_NAMES if f"{name}_score" in df.columns]
+    if score_columns:
+        moderation = df[score_columns].apply(pd.to_numeric, errors="coerce")
+        # failed moderation is null, or all 0.0 in files written before nulls were stored
+        df = df[moderation.notna().all(axis=1) & moderation.ne(0).any(axis=1)]
+    df = df[df[column].notna()]
+    df = df.loc[~df[column].map(fold_text).duplicated(keep="last")]
+    score = pd.to_numeric(df["aggressiveness_score"], errors="coerce")
+    score = score.where(score.between(0, SCORE_CLASSES - 1)).fillna(-1).astype(int).to_numpy()
+    scores = np.full((len(df), len(CATEGORY_NAMES)), np.nan, dtype=np.float32)
+    flags = np.full((len(df), len(CATEGORY_NAMES)), np.nan, dtype=np.float32)
+    for j, name in enumerate(CATEGORY_NAMES):
+        if f"{name}_score" in df.columns:
+            scores[:, j] = pd.to_numeric(df[f"{name}_score"], errors="coerce").to_numpy()
+        if f"{name}_flag" in df.columns:
+            flags[:, j] = pd.to_numeric(df[f"{name}_flag"].map({True: 1.0, False: 0.0}), errors="coerce").to_numpy()
+    return df[column].tolist(), {"score": score, "scores": scores, "flags": flags}
+
+
+def evaluate(model: LocalModel, texts, targets: dict, min_confidence: float) -> dict:
+    """Return accuracy figures of ``model`` on labelled ``texts``."""
+    predicted = model.predict(texts)
+    labelled = targets["score"] >= 0
+    truth = targets["score"][labelled]
+    score = predicted["score"][labelled]
+    confident = predicted["confidence"][labelled] >= min_confidence
+    report = {
+        "rows": int(labelled.sum()),
+        "exact": float((score == truth).mean()) if len(truth) else 0.0,
+        "within_1": float((np.abs(score - truth) <= 1).mean()) if len(truth) else 0.0,
+        "mae": float(np.abs(predicted["expected"][labelled] - truth).mean()) if len(truth) else 0.0,
+        "coverage": float(confident.mean()) if len(truth) else 0.0,
+    }
+    report["confident_within_1"] = (
+        float((np.abs(score[confident] - truth[confident]) <= 1).mean()) if confident.any() else 0.0
+    )
+    return report
+
+
+def main(argv=None) -> int:
+    """Train a local model from result files and report holdout accuracy."""
+    parser = argparse.ArgumentParser(description="分析結果からローカルモデルを学習します")
+    parser.add_argument("results", nargs="+", help="result files (.xlsx/.csv) of earlier runs")
+    parser.add_argument("--column", required=True, help="column containing the posts")
+    parser.add_argument("-o", "--output", default=DEFAULT_LOCAL_MODEL_SETTINGS["path"])
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--features", type=int, default=DEFAULT_FEATURES, help="number of hash buckets")
+    parser.add_argument("--holdout", type=float, default=0.1, help="share of rows kept for evaluation")
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=DEFAULT_LOCAL_MODEL_SETTINGS["min_confidence"],
+        help="confidence used for the hybrid coverage figures",
+    )
+    args = parser.parse_args(argv)
+
+    texts, targets = load_training_data(args.results, args.column)
+    order = np.random.default_rng(0).permutation(len(texts))
+    cut = int(len(texts) * (1 - args.holdout))
+    train, test = order[:cut], order[cut:]
+
+    def subset(rows):
+        return [texts[i] for i in rows], {key: value[rows] for key, value in targets.items()}
+
+    model = LocalModel(args.features).fit(*subset(train), epochs=args.epochs)
+    if len(test):
+        for key, value in evaluate(model, *subset(test), args.min_confidence).items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    model.save(args.output)
+    print(f"saved {args.output} ({len(train)} rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,30 @@
-import os
-from openai import AsyncOpenAI
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import sys
 
 from config import ConfigManager
-from analyzer import TextAnalyzer
 from ui import ModerationApp
 
 
-def main():
+def report_startup(app: ModerationApp):
+    """Print the seconds until the first frame was drawn and close ``app``."""
+    app.update()
+    print(f"startup: {time.perf_counter() - STARTED:.3f}s", file=sys.stderr, flush=True)
+    app.destroy()
+
+
+def main(argv=None):
+    """Open the moderation window."""
+    parser = argparse.ArgumentParser(description="テキストモデレーションツール")
+    parser.add_argument("--startup-time", action="store_true", help="print the time to the first frame and exit")
+    args = parser.parse_args(argv)
     config = ConfigManager()
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    if client.api_key is None:
-        raise ValueError("OpenAI APIキーが設定されていません。環境変数 'OPENAI_API_KEY' を設定してください。")
-    analyzer = TextAnalyzer(client)
-    app = ModerationApp(analyzer, config)
+    app = ModerationApp(config)
+    if args.startup_time:
+        app.after_idle(report_startup, app)
     app.mainloop()
 
 
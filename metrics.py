@@ -0,0 +1,251 @@
+import bisect
+import collections
+import json
+import os
+import random
+import time
+
+# upper bounds (seconds) of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# latencies kept per endpoint for percentiles; longer runs keep a uniform sample
+LATENCY_SAMPLE_SIZE = 10000
+
+
+def report_path(input_path: str, directory: str, extension: str) -> str:
+    """Return a timestamped report path for a run over ``input_path``."""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(directory, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}{extension}")
+
+
+class EndpointMetrics:
+    """Counters and latencies of one API endpoint during a run.
+
+    Memory stays bounded on long-running services: the request count,
+    latency sum and histogram buckets cover every request, while
+    percentiles come from a reservoir sample of ``LATENCY_SAMPLE_SIZE``
+    latencies.
+    """
+
+    def __init__(self):
+        """Start with empty counters."""
+        self.latencies = []
+        self.requests = 0
+        self.latency_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sampler = random.Random(0)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = collections.Counter()
+        self.failures = collections.Counter()
+        self.parse_failures = 0
+
+    def add_latency(self, latency: float):
+        """Count one successful request that took ``latency`` seconds."""
+        self.requests += 1
+        self.latency_sum += latency
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        if len(self.latencies) < LATENCY_SAMPLE_SIZE:
+            self.latencies.append(latency)
+        else:
+            slot = self.sampler.randrange(self.requests)
+            if slot < LATENCY_SAMPLE_SIZE:
+                self.latencies[slot] = latency
+
+    def merge(self, other: "EndpointMetrics"):
+        """Add the counters and latencies of ``other``, e.g. from another process."""
+        total = self.requests + other.requests
+        if len(self.latencies) + len(other.latencies) > LATENCY_SAMPLE_SIZE:
+            # each side keeps a share of the sample proportional to its requests
+            mine = min(round(LATENCY_SAMPLE_SIZE * self.requests / total), len(self.latencies))
+            theirs = min(LATENCY_SAMPLE_SIZE - mine, len(other.latencies))
+            self.latencies = self.sampler.sample(self.latencies, mine) + self.sampler.sample(other.latencies, theirs)
+        else:
+            self.latencies = self.latencies + other.latencies
+        self.requests = total
+        self.latency_sum += other.latency_sum
+        self.bucket_counts = [a + b for a, b in zip(self.bucket_counts, other.bucket_counts)]
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.retries.update(other.retries)
+        self.failures.update(other.failures)
+        self.parse_failures += other.parse_failures
+
+    def percentile(self, q: float) -> float:
+        """Return the ``q``-th latency percentile in seconds, or ``None``."""
+        if not self.latencies:
+            return None
+        import numpy as np
+
+        return float(np.percentile(self.latencies, q))
+
+    def summary(self) -> dict:
+        """Return the endpoint figures as a JSON-serializable dict."""
+        return {
+            "requests": self.requests,
+            "latency_p50": self.percentile(50),
+            "latency_p95": self.percentile(95),
+            "latency_p99": self.percentile(99),
+            "latency_mean": self.latency_sum / self.requests if self.requests else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "retries": dict(self.retries),
+            "failures": dict(self.failures),
+            "parse_failures": self.parse_failures,
+        }
+
+
+class RunMetrics:
+    """Per-endpoint request metrics of one analysis run.
+
+    ``RequestScheduler`` records every API call here; the analyzer adds
+    replies it could not parse. Cache hits are taken as the difference of
+    the cache counters since the run started.
+    """
+
+    def __init__(self, cache=None, prices: dict = None):
+        """Start a run; ``prices`` maps endpoint to USD per 1M prompt/completion tokens."""
+        self.cache = cache
+        self.prices = prices or {}
+        self.endpoints = collections.defaultdict(EndpointMetrics)
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.rows = 0
+        self.cache_base = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    def record_request(self, endpoint: str, latency: float, usage=None):
+        """Record a successful request and its token usage."""
+        metrics = self.endpoints[endpoint]
+        metrics.add_latency(latency)
+        if usage is not None:
+            metrics.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            metrics.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def record_retry(self, endpoint: str, cause: str):
+        """Record a failed attempt that will be retried."""
+        self.endpoints[endpoint].retries[cause] += 1
+
+    def record_failure(self, endpoint: str, cause: str):
+        """Record a request that failed for good."""
+        self.endpoints[endpoint].failures[cause] += 1
+
+    def record_parse_failure(self, endpoint: str, count: int = 1):
+        """Record replies that arrived but could not be used."""
+        self.endpoints[endpoint].parse_failures += count
+
+    def merge(self, endpoints: dict):
+        """Add the per-endpoint metrics of another run, e.g. a worker process."""
+        for name, metrics in endpoints.items():
+            self.endpoints[name].merge(metrics)
+
+    def finish(self, rows: int):
+        """Close the run that analyzed ``rows`` rows."""
+        self.rows = rows
+        self.elapsed = time.monotonic() - self.started
+
+    def cache_counts(self) -> tuple:
+        """Return ``(hits, misses)`` of the cache since the run started."""
+        if self.cache is None:
+            return 0, 0
+        return self.cache.hits - self.cache_base[0], self.cache.misses - self.cache_base[1]
+
+    def cost(self, endpoint: str) -> float:
+        """Return the USD cost of ``endpoint``, or ``None`` without a price."""
+        price = self.prices.get(endpoint)
+        if not price:
+            return None
+        metrics = self.endpoints[endpoint]
+        return (metrics.prompt_tokens * price.get("prompt", 0.0)
+                + metrics.completion_tokens * price.get("completion", 0.0)) / 1_000_000
+
+    def report(self) -> dict:
+        """Return the whole run report as a JSON-serializable dict."""
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self.started
+        hits, misses = self.cache_counts()
+        endpoints = {}
+        for name, metrics in sorted(self.endpoints.items()):
+            summary = metrics.summary()
+            tokens = metrics.prompt_tokens + metrics.completion_tokens
+            summary["tokens_per_1k_rows"] = tokens / self.rows * 1000 if self.rows else None
+            cost = self.cost(name)
+            summary["cost_usd"] = cost
+            summary["cost_per_1k_rows_usd"] = cost / self.rows * 1000 if cost is not None and self.rows else None
+            endpoints[name] = summary
+        return {
+            "rows": self.rows,
+            "elapsed_seconds": elapsed,
+            "rows_per_second": self.rows / elapsed if elapsed else None,
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "endpoints": endpoints,
+        }
+
+    def summary_text(self) -> str:
+        """Return a one-line summary for status displays."""
+        parts = []
+        for name, summary in self.report()["endpoints"].items():
+            if not summary["requests"]:
+                continue
+            text = (
+                f"{name}: {summary['requests']}件 p50 {summary['latency_p50']:.2f}s "
+                f"p95 {summary['latency_p95']:.2f}s p99 {summary['latency_p99']:.2f}s "
+                f"再試行 {sum(summary['retries'].values())} 失敗 {sum(summary['failures'].values())}"
+            )
+            if summary["tokens_per_1k_rows"]:
+                text += f" 1k件あたり {summary['tokens_per_1k_rows']:,.0f}トークン"
+            if summary["cost_per_1k_rows_usd"] is not None:
+                text += f" (${summary['cost_per_1k_rows_usd']:.3f})"
+            parts.append(text)
+        return " / ".join(parts) if parts else "API呼び出しなし"
+
+    def write_json(self, path: str):
+        """Write ``report()`` to ``path``."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def prometheus_text(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        import numpy as np
+
+        lines = [
+            "# HELP uhalis_request_latency_seconds Latency of successful API requests.",
+            "# TYPE uhalis_request_latency_seconds histogram",
+        ]
+        for name, metrics in sorted(self.endpoints.items()):
+            counts = np.cumsum(metrics.bucket_counts)
+            for bound, count in zip(LATENCY_BUCKETS, counts):
+                lines.append(f'uhalis_request_latency_seconds_bucket{{endpoint="{name}",le="{bound}"}} {count}')
+            lines.append(f'uhalis_request_latency_seconds_bucket{{endpoint="{name}",le="+Inf"}} {metrics.requests}')
+            lines.append(f'uhalis_request_latency_seconds_sum{{endpoint="{name}"}} {metrics.latency_sum}')
+            lines.append(f'uhalis_request_latency_seconds_count{{endpoint="{name}"}} {metrics.requests}')
+        lines += ["# HELP uhalis_tokens_total Tokens reported by the API.", "# TYPE uhalis_tokens_total counter"]
+        for name, metrics in sorted(self.endpoints.items()):
+            lines.append(f'uhalis_tokens_total{{endpoint="{name}",kind="prompt"}} {metrics.prompt_tokens}')
+            lines.append(f'uhalis_tokens_total{{endpoint="{name}",kind="completion"}} {metrics.completion_tokens}')
+        for metric, attr, help_text in (
+            ("uhalis_retries_total", "retries", "Retried API attempts by cause."),
+            ("uhalis_failures_total", "failures", "API requests that failed for good by cause."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for name, metrics in sorted(self.endpoints.items()):
+                for cause, count in sorted(getattr(metrics, attr).items()):
+                    lines.append(f'{metric}{{endpoint="{name}",cause="{cause}"}} {count}')
+        lines += ["# HELP uhalis_parse_failures_total Replies that could not be parsed.",
+                  "# TYPE uhalis_parse_failures_total counter"]
+        for name, metrics in sorted(self.endpoints.items()):
+            lines.append(f'uhalis_parse_failures_total{{endpoint="{name}"}} {metrics.parse_failures}')
+        report = self.report()
+        for metric, kind, value in (
+            ("uhalis_cache_hits_total", "counter", report["cache_hits"]),
+            ("uhalis_cache_misses_total", "counter", report["cache_misses"]),
+            ("uhalis_rows_total", "counter", report["rows"]),
+            ("uhalis_run_seconds", "gauge", report["elapsed_seconds"]),
+        ):
+            lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write ``prometheus_text()`` to ``path``."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
@@ -0,0 +1,252 @@
+"""Local stand-in for the OpenAI moderation and chat completion endpoints.
+
+Used by ``benchmark.py``; it can also be started on its own and the GUI
+or CLI pointed at it through ``OPENAI_BASE_URL``::
+
+    python mock_server.py --port 8089 --chat-latency-ms 400 --rate-429 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-mock python cli.py posts.xlsx --column 投稿内容
+
+Replies are deterministic per text: the score is derived from a hash of the
+post, and moderation scores follow the score.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import threading
+import zlib
+
+from config import CATEGORY_NAMES
+
+# the API reports these categories in addition to the ones the tool reads
+EXTRA_CATEGORIES = ["harassment", "harassment/threatening", "illicit", "illicit/violent",
+                    "self-harm/instructions", "self-harm/intent"]
+REASON = "モックサーバーによる固定の理由です。ベンチマーク用のため内容に意味はありません。"
+
+
+def text_score(text: str) -> int:
+    """Return the deterministic aggressiveness score of ``text``."""
+    return zlib.crc32(str(text).encode("utf-8")) % 10
+
+
+class MockOpenAIServer:
+    """Minimal HTTP/1.1 server answering like the OpenAI API.
+
+    Latencies are drawn from a log-normal distribution around the median
+    of each endpoint. ``rate_429`` and ``rate_5xx`` are the probabilities
+    of answering a request with a rate-limit or server error instead.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        chat_latency: float = 0.4,
+        moderation_latency: float = 0.15,
+        latency_sigma: float = 0.5,
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        seed: int = 0,
+    ):
+        """Store the latency and error settings; times are in seconds."""
+        self.host = host
+        self.port = port
+        self.latency = {"chat": chat_latency, "moderations": moderation_latency}
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.random = random.Random(seed)
+        self.requests = {"chat": 0, "moderations": 0}
+        self.injected = {"429": 0, "5xx": 0}
+        self.server = None
+        self.connections = set()
+        self.loop = None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        """Return the ``/v1`` URL clients should use."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> str:
+        """Start listening on the current loop and return ``base_url``."""
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    def start_in_thread(self) -> str:
+        """Run the server on its own event loop thread and return ``base_url``."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="mock-openai", daemon=True)
+        self.thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    def stop(self):
+        """Stop a server started with ``start_in_thread``."""
+        async def close():
+            self.server.close()
+            for task in self.connections:
+                task.cancel()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer requests on one keep-alive connection."""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, extra, payload = await self.respond(path, json.loads(body or b"{}"))
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "content-type: application/json", f"content-length: {len(data)}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def respond(self, path: str, body: dict):
+        """Return ``(status, headers, payload)`` for a request to ``path``."""
+        endpoint = "moderations" if path.rstrip("/").endswith("/moderations") else "chat"
+        self.requests[endpoint] += 1
+        median = self.latency[endpoint]
+        if median > 0:
+            await asyncio.sleep(median * math.exp(self.random.gauss(0.0, self.latency_sigma)))
+        draw = self.random.random()
+        if draw < self.rate_429:
+            self.injected["429"] += 1
+            error = {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}
+            return 429, {"retry-after-ms": "100"}, {"error": error}
+        if draw < self.rate_429 + self.rate_5xx:
+            self.injected["5xx"] += 1
+            return 503, {}, {"error": {"message": "Service unavailable (mock)", "type": "server_error", "code": None}}
+        if endpoint == "moderations":
+            return 200, {}, self.moderation(body)
+        return 200, {}, self.chat(body)
+
+    def moderation(self, body: dict) -> dict:
+        """Return a moderation response for ``body["input"]``."""
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        results = []
+        for text in inputs:
+            level = text_score(text) / 9
+            scores = {name: round(level * (0.9 if name in ("hate", "violence") else 0.3), 6)
+                      for name in CATEGORY_NAMES + EXTRA_CATEGORIES}
+            categories = {name: value >= 0.5 for name, value in scores.items()}
+            results.append({
+                "flagged": any(categories.values()),
+                "categories": categories,
+                "category_scores": scores,
+                "category_applied_input_types": {name: ["text"] for name in scores},
+            })
+        return {"id": "modr-mock", "model": body.get("model", "mock"), "results": results}
+
+    def chat(self, body: dict) -> dict:
+        """Return a chat completion in the format the request asked for."""
+        prompt = body["messages"][-1]["content"]
+        post = prompt.split("# 分析対象の文章", 1)[-1].split("# 回答形式", 1)[0]
+        choice = {"index": 0, "finish_reason": "stop"}
+        if body.get("response_format"):
+            posts = json.loads(post.split("\n", 1)[1].strip())
+            results = [{"id": p["id"], "score": text_score(p["text"]), "reason": REASON} for p in posts]
+            content = json.dumps({"results": results}, ensure_ascii=False)
+            completion_tokens = 40 * len(posts)
+        elif body.get("logprobs"):
+            score = text_score(post.split("\n", 1)[1].strip())
+            content = str(score)
+            neighbour = min(score + 1, 9) if score < 9 else 8
+            top = [{"token": str(score), "logprob": math.log(0.7), "bytes": None},
+                   {"token": str(neighbour), "logprob": math.log(0.3), "bytes": None}]
+            choice["finish_reason"] = "length"
+            choice["logprobs"] = {"content": [{"token": content, "logprob": math.log(0.7), "bytes": None,
+                                               "top_logprobs": top}]}
+            completion_tokens = 1
+        else:
+            score = text_score(post.split("\n", 1)[1].strip())
+            content = f"スコア: {score}\n理由: {REASON}"
+            completion_tokens = 40
+        choice["message"] = {"role": "assistant", "content": content}
+        prompt_tokens = len(prompt)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "mock"),
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """Add the latency and error injection options to ``parser``."""
+    parser.add_argument("--chat-latency-ms", type=float, default=400.0, help="median chat latency")
+    parser.add_argument("--moderation-latency-ms", type=float, default=150.0, help="median moderation latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of latencies")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def server_from_args(args: argparse.Namespace, port: int = 0) -> MockOpenAIServer:
+    """Create a server from the options added by ``add_server_arguments``."""
+    return MockOpenAIServer(
+        port=port,
+        chat_latency=args.chat_latency_ms / 1000,
+        moderation_latency=args.moderation_latency_ms / 1000,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        seed=args.seed,
+    )
+
+
+async def serve_forever(server: MockOpenAIServer):
+    """Start ``server`` on the current loop and keep it running."""
+    print(f"mock OpenAI API listening on {await server.start()}", flush=True)
+    await server.server.serve_forever()
+
+
+def main(argv=None) -> int:
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description="OpenAI API のモックサーバー")
+    parser.add_argument("--port", type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve_forever(server_from_args(args, args.port)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
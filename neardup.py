@@ -0,0 +1,177 @@
+"""Near-duplicate clustering of posts with MinHash signatures and LSH.
+
+Spam bursts and coordinated harassment repeat one post with a different
+mention, URL or trailing emoji. Posts are reduced to their letters and
+digits (mentions and URLs removed, NFKC, case and kana folded), cut into
+character shingles and summarized by MinHash signatures. Locality
+sensitive hashing over bands of the signatures proposes candidate pairs,
+and a candidate joins a cluster only if its estimated Jaccard similarity
+to the cluster's representative, the first post of the cluster, reaches
+the threshold. Only representatives are analyzed.
+"""
+import re
+
+import numpy as np
+
+from prefilter import fold_text
+
+_NOISE = re.compile(r"https?://\S+|www\.\S+|[@＠][\w.]+")
+# texts are signed in blocks so shingle arrays stay small on million-row jobs
+_BLOCK_SIZE = 20000
+_SHINGLE_BASE = np.uint64(1000003)
+
+
+def canonical_text(text) -> str:
+    """Return the letters and digits of ``text`` without mentions and URLs."""
+    folded = _NOISE.sub(" ", fold_text(text))
+    return "".join(ch for ch in folded if ch.isalnum())
+
+
+def choose_bands(num_perm: int, threshold: float) -> tuple:
+    """Return ``(bands, rows)`` whose LSH threshold lies safely below ``threshold``.
+
+    Candidates are verified afterwards, so the banding only has to catch
+    pairs at ``threshold`` with high probability.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold - 0.1:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateIndex:
+    """Cluster near-identical posts so that one representative is analyzed."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_size: int = 3, seed: int = 0):
+        """Prepare ``num_perm`` MinHash functions for Jaccard ``threshold``."""
+        if not 0 < threshold <= 1:
+            raise ValueError(f"類似度のしきい値は0より大きく1以下で指定してください: {threshold}")
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.mult = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.add = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self.merged = 0
+        self.clusters = 0
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "NearDuplicateIndex":
+        """Create an index from the ``near_duplicates`` section of ``config.json``."""
+        return cls(settings["threshold"], settings["num_perm"], settings["shingle_size"])
+
+    def signatures(self, texts: list) -> np.ndarray:
+        """Return the ``(len(texts), num_perm)`` MinHash signatures of ``texts``.
+
+        Texts without letters or digits get an all-zero row and are never
+        clustered (see ``cluster``).
+        """
+        signatures = np.zeros((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), _BLOCK_SIZE):
+            keys = [canonical_text(text) for text in texts[start:start + _BLOCK_SIZE]]
+            signed = [i for i, key in enumerate(keys) if key]
+            if signed:
+                signatures[start + np.array(signed)] = self._sign([keys[i] for i in signed])
+        return signatures
+
+    def _sign(self, keys: list) -> np.ndarray:
+        """Return MinHash signatures of non-empty canonical ``keys``."""
+        k = self.shingle_size
+        # keys shorter than a shingle are padded so that they form one shingle
+        keys = [key.ljust(k, "\0") for key in keys]
+        lengths = np.fromiter((len(key) for key in keys), dtype=np.int64, count=len(keys))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        codes = np.frombuffer("".join(keys).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        # rolling hash of every k consecutive code points
+        count = len(codes) - k + 1
+        shingles = codes[:count].copy()
+        for offset in range(1, k):
+            shingles = shingles * _SHINGLE_BASE + codes[offset:offset + count]
+        # keep shingles that start and end inside the same key
+        owner = np.repeat(np.arange(len(keys)), lengths)[:count]
+        shingles = shingles[np.arange(count) + k - 1 < (starts + lengths)[owner]]
+        first = np.concatenate(([0], np.cumsum(lengths - k + 1)[:-1]))
+        signatures = np.empty((len(keys), self.num_perm), dtype=np.uint32)
+        for p in range(self.num_perm):
+            hashed = (shingles * self.mult[p] + self.add[p]) >> np.uint64(32)
+            signatures[:, p] = np.minimum.reduceat(hashed, first)
+        return signatures
+
+    def cluster(self, texts: list) -> np.ndarray:
+        """Return for every text the index of its cluster representative.
+
+        The representative is the first text of its cluster; texts that
+        are not near-duplicates of an earlier one represent themselves.
+        """
+        size = len(texts)
+        representative = np.arange(size)
+        if size < 2:
+            return representative
+        signatures = self.signatures(texts)
+        signed = signatures.any(axis=1)
+        parent = list(range(size))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        weights = np.random.default_rng(1).integers(1, 2**63, self.rows, dtype=np.uint64)
+        for band in range(self.bands):
+            block = signatures[:, band * self.rows:(band + 1) * self.rows].astype(np.uint64)
+            keys = (block * weights).sum(axis=1)
+            order = np.argsort(keys, kind="stable")
+            order = order[signed[order]]
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+            run_first = order[np.repeat(starts, np.diff(np.append(starts, len(order))))]
+            pairs = np.flatnonzero(run_first != order)
+            if not len(pairs):
+                continue
+            left, right = run_first[pairs], order[pairs]
+            similar = (signatures[left] == signatures[right]).mean(axis=1) >= self.threshold
+            for a, b in zip(left[similar].tolist(), right[similar].tolist()):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+        roots = np.fromiter((find(i) for i in range(size)), dtype=np.int64, count=size)
+        # a chain of similar posts may drift; members must resemble the representative itself
+        close = (signatures == signatures[roots]).mean(axis=1) >= self.threshold
+        representative[close] = roots[close]
+        return representative
+
+    def merge(self, texts: list, groups: list) -> tuple:
+        """Merge the row groups of near-duplicate ``texts``.
+
+        ``texts`` and ``groups`` are the output of ``group_duplicates``.
+
+        Returns
+        -------
+        tuple
+            ``(texts, groups)`` with one entry per cluster: the
+            representative text and the rows of every member.
+        """
+        representative = self.cluster(texts)
+        kept_texts = []
+        kept_groups = []
+        position = {}
+        for i, rep in enumerate(representative.tolist()):
+            if rep == i:
+                position[i] = len(kept_texts)
+                kept_texts.append(texts[i])
+                kept_groups.append(list(groups[i]))
+            else:
+                kept_groups[position[rep]].extend(groups[i])
+        self.merged += len(texts) - len(kept_texts)
+        self.clusters += len(set(representative[representative != np.arange(len(texts))].tolist()))
+        return kept_texts, kept_groups
+
+    def stats_text(self) -> str:
+        """Return a short summary for status displays."""
+        return f"類似投稿: {self.merged}件を{self.clusters}クラスタに統合"
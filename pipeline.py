@@ -0,0 +1,527 @@
+import asyncio
+import collections
+from typing import TYPE_CHECKING
+
+from analyzer import TextAnalyzer
+from cache import normalize_text
+from config import (
+    CATEGORY_NAMES,
+    ConfigManager,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_REASON_THRESHOLD,
+    DEFAULT_SCORE_BATCH_SIZE,
+    DEFAULT_TEMPERATURE,
+    DEFAULT_TOP_P,
+    MODERATION_BATCH_SIZE,
+    SCORE_MODE_FULL,
+    SCORE_MODE_SCORE_ONLY,
+)
+from journal import RunJournal
+from prefilter import BENIGN_REASON
+
+if TYPE_CHECKING:
+    # pandas is imported on first use to keep GUI startup fast
+    import pandas as pd
+
+DECIDED_BY_LLM = "llm"
+DECIDED_BY_PREFILTER = "prefilter"
+DECIDED_BY_LOCAL = "local"
+
+
+
+class AnalysisOptions:
+    """Settings that control how rows are analyzed."""
+
+    def __init__(
+        self,
+        temperature: float = DEFAULT_TEMPERATURE,
+        top_p: float = DEFAULT_TOP_P,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_size: int = MODERATION_BATCH_SIZE,
+        score_batch_size: int = DEFAULT_SCORE_BATCH_SIZE,
+        score_mode: str = SCORE_MODE_FULL,
+        reason_threshold: int = DEFAULT_REASON_THRESHOLD,
+    ):
+        """Store the analysis settings.
+
+        ``score_mode`` is ``"full"`` (score and reason per post) or
+        ``"score_only"`` (single-token score; reasons only for posts scoring
+        at least ``reason_threshold``).
+        """
+        self.temperature = temperature
+        self.top_p = top_p
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.score_batch_size = score_batch_size
+        self.score_mode = score_mode
+        self.reason_threshold = reason_threshold
+
+    @classmethod
+    def from_config(cls, config: ConfigManager) -> "AnalysisOptions":
+        """Create options from the values stored in ``config``."""
+        return cls(
+            temperature=config.get_temperature(),
+            top_p=config.get_top_p(),
+            concurrency=config.get_concurrency(),
+            batch_size=config.get_moderation_batch_size(),
+            score_batch_size=config.get_score_batch_size(),
+            score_mode=config.get_score_mode(),
+            reason_threshold=config.get_reason_threshold(),
+        )
+
+
+def make_record(cats, scores, ag_score, ag_reason, ag_expected=None, decided_by=DECIDED_BY_LLM) -> dict:
+    """Return the JSON-serializable result record of one row.
+
+    ``flags`` and ``scores`` are ``None`` when moderation failed.
+    ``ag_expected`` is only set in score-only mode. ``decided_by`` names
+    the stage that produced the aggressiveness score.
+    """
+    flags = values = None
+    if cats is not None and scores is not None:
+        flags = {}
+        values = {}
+        for name in CATEGORY_NAMES:
+            attr = name.replace("/", "_")
+            flags[name] = bool(getattr(cats, attr, False))
+            values[name] = float(getattr(scores, attr, 0.0) or 0.0)
+    return {
+        "flags": flags,
+        "scores": values,
+        "aggressiveness_score": ag_score,
+        "aggressiveness_reason": ag_reason,
+        "aggressiveness_expected": ag_expected,
+        "decided_by": decided_by,
+    }
+
+
+def benign_record(score_only: bool = False) -> dict:
+    """Return the record of a post the local prefilter routed as benign."""
+    record = make_record(None, None, 0, BENIGN_REASON, 0.0 if score_only else None, DECIDED_BY_PREFILTER)
+    record["flags"] = {name: False for name in CATEGORY_NAMES}
+    record["scores"] = {name: 0.0 for name in CATEGORY_NAMES}
+    return record
+
+
+def local_record(decision: dict, score_only: bool = False) -> dict:
+    """Return the record of a post the local model answered with enough confidence."""
+    reason = f"ローカルモデルによる判定 (確信度 {decision['confidence']:.2f})"
+    record = make_record(
+        None,
+        None,
+        decision["score"],
+        reason,
+        decision["expected"] if score_only else None,
+        DECIDED_BY_LOCAL,
+    )
+    record["flags"] = decision["flags"]
+    record["scores"] = decision["scores"]
+    return record
+
+
+def is_complete(record: dict) -> bool:
+    """Return ``True`` if both moderation and scoring succeeded."""
+    return record["flags"] is not None and record["aggressiveness_score"] is not None
+
+
+class StringColumn:
+    """Column of repeated strings stored as integer codes into a list of unique values.
+
+    Reasons and stage labels repeat a lot (canned benign/local reasons,
+    three stage names), so each distinct string is kept once.
+    """
+
+    def __init__(self, size: int, dtype: str, default: str = None):
+        """Preallocate ``size`` entries of ``default`` with codes of ``dtype``."""
+        import numpy as np
+
+        self.values = [] if default is None else [default]
+        self.lookup = {value: code for code, value in enumerate(self.values)}
+        self.codes = np.full(size, -1 if default is None else 0, dtype=dtype)
+
+    def set(self, index: int, value: str):
+        """Store ``value`` (or ``None``) at ``index``."""
+        if value is None:
+            self.codes[index] = -1
+            return
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes[index] = code
+
+    def get(self, index: int) -> str:
+        """Return the string at ``index``, or ``None``."""
+        code = self.codes[index]
+        return self.values[code] if code >= 0 else None
+
+    def categorical(self):
+        """Return the column as a ``pandas.Categorical`` over the stored codes."""
+        import pandas as pd
+
+        return pd.Categorical.from_codes(self.codes, categories=self.values)
+
+
+class AnalysisResults:
+    """Collect per-row analysis output in the original row order.
+
+    Results live in preallocated typed arrays (``bool`` flags, ``float32``
+    scores, ``int8`` aggressiveness with ``MISSING_SCORE`` for rows without
+    one and code-interned strings) that rows are written into by index in
+    any order. ``columns`` wraps the arrays without copying them.
+    """
+
+    MISSING_SCORE = -1
+
+    def __init__(self, size: int):
+        """Preallocate result slots for ``size`` rows."""
+        import numpy as np
+
+        self.size = size
+        self.flags = {name: np.zeros(size, dtype=bool) for name in CATEGORY_NAMES}
+        self.scores = {name: np.zeros(size, dtype=np.float32) for name in CATEGORY_NAMES}
+        self.ag_scores = np.full(size, self.MISSING_SCORE, dtype=np.int8)
+        self.ag_reasons = StringColumn(size, "int32")
+        self.ag_expected = np.full(size, np.nan, dtype=np.float32)
+        self.decided_by = StringColumn(size, "int8", DECIDED_BY_LLM)
+        self.moderated = np.zeros(size, dtype=bool)
+        self.cluster_ids = None
+        self.unique_rows = size
+        self.resumed_rows = 0
+
+    def set(self, index: int, record: dict):
+        """Store the result record of row ``index``."""
+        if record["flags"] is not None:
+            self.moderated[index] = True
+            for name in CATEGORY_NAMES:
+                self.flags[name][index] = record["flags"][name]
+                self.scores[name][index] = record["scores"][name]
+        score = record["aggressiveness_score"]
+        self.ag_scores[index] = self.MISSING_SCORE if score is None else score
+        self.ag_reasons.set(index, record["aggressiveness_reason"])
+        expected = record.get("aggressiveness_expected")
+        self.ag_expected[index] = float("nan") if expected is None else expected
+        self.decided_by.set(index, record.get("decided_by", DECIDED_BY_LLM))
+
+    def record(self, index: int) -> dict:
+        """Return the result record of row ``index`` as stored by ``set``."""
+        flags = scores = None
+        if self.moderated[index]:
+            flags = {name: bool(self.flags[name][index]) for name in CATEGORY_NAMES}
+            # str() gives the shortest form, so 0.8 does not come back as 0.800000011920929
+            scores = {name: float(str(self.scores[name][index])) for name in CATEGORY_NAMES}
+        score = int(self.ag_scores[index])
+        expected = float(self.ag_expected[index])
+        return {
+            "flags": flags,
+            "scores": scores,
+            "aggressiveness_score": None if score == self.MISSING_SCORE else score,
+            "aggressiveness_reason": self.ag_reasons.get(index),
+            "aggressiveness_expected": None if expected != expected else float(str(self.ag_expected[index])),
+            "decided_by": self.decided_by.get(index),
+        }
+
+    def set_clusters(self, groups: list):
+        """Record the row each group of rows took its result from.
+
+        ``groups`` are row groups as returned by ``group_duplicates`` or
+        ``NearDuplicateIndex.merge``; the first row of a group is the one
+        that was analyzed. Rows outside ``groups`` have no cluster id.
+        """
+        import numpy as np
+
+        if self.cluster_ids is None:
+            self.cluster_ids = np.full(self.size, -1, dtype=np.int64)
+        for group in groups:
+            self.cluster_ids[group] = group[0]
+
+    def failed_rows(self) -> int:
+        """Return the number of rows without an aggressiveness score."""
+        return int((self.ag_scores == self.MISSING_SCORE).sum())
+
+    def columns(self) -> dict:
+        """Return a mapping of output column name to array.
+
+        The arrays share memory with the results and carry no index. Use
+        ``frame`` or ``attach`` to hand them to pandas: assigning them one
+        by one (``df[name] = values``) copies every column under pandas'
+        copy-on-write. Flags and category scores share one read-only mask
+        of the rows whose moderation failed, so they cannot be edited in
+        place.
+        """
+        import numpy as np
+        import pandas as pd
+
+        # rows whose moderation failed have no flags or scores, not clean ones
+        missing = ~self.moderated
+        missing.flags.writeable = False
+        cols = {}
+        for name in CATEGORY_NAMES:
+            cols[f"{name}_flag"] = pd.arrays.BooleanArray(self.flags[name], missing)
+            cols[f"{name}_score"] = pd.arrays.FloatingArray(self.scores[name], missing)
+        cols["aggressiveness_score"] = pd.arrays.IntegerArray(self.ag_scores, self.ag_scores == self.MISSING_SCORE)
+        cols["aggressiveness_reason"] = self.ag_reasons.categorical()
+        if not np.isnan(self.ag_expected).all():
+            cols["aggressiveness_expected"] = self.ag_expected
+        cols["decided_by"] = self.decided_by.categorical()
+        if self.cluster_ids is not None:
+            cols["cluster_id"] = pd.arrays.IntegerArray(self.cluster_ids, self.cluster_ids < 0)
+        return cols
+
+    def frame(self, index=None) -> "pd.DataFrame":
+        """Return the result columns as a DataFrame that shares memory with the results."""
+        import pandas as pd
+
+        return pd.DataFrame(self.columns(), index=index, copy=False)
+
+    def attach(self, df: "pd.DataFrame") -> "pd.DataFrame":
+        """Return ``df`` with the result columns added by position, replacing earlier ones.
+
+        Neither the results nor the columns of ``df`` are copied.
+        """
+        import pandas as pd
+
+        results = self.frame(df.index)
+        return pd.concat([df.drop(columns=results.columns.intersection(df.columns)), results], axis=1)
+
+    def dedup_text(self) -> str:
+        """Return a short summary of how many rows were deduplicated."""
+        analyzed = self.size - self.resumed_rows
+        saved = 1 - self.unique_rows / analyzed if analyzed else 0.0
+        text = f"重複除去: {analyzed}件→{self.unique_rows}件 ({saved:.1%}削減)"
+        if self.resumed_rows:
+            text += f" 再開: {self.resumed_rows}件スキップ"
+        return text
+
+
+def group_duplicates(texts: list):
+    """Group rows whose normalized text is identical.
+
+    Returns
+    -------
+    tuple
+        ``(unique_texts, groups)`` where ``groups[i]`` lists the row
+        indices that share ``unique_texts[i]``.
+    """
+    positions = {}
+    unique_texts = []
+    groups = []
+    for index, text in enumerate(texts):
+        key = normalize_text(text)
+        pos = positions.get(key)
+        if pos is None:
+            positions[key] = len(unique_texts)
+            unique_texts.append(text)
+            groups.append([index])
+        else:
+            groups[pos].append(index)
+    return unique_texts, groups
+
+
+async def analyze_rows(
+    analyzer: TextAnalyzer,
+    texts: list,
+    options: AnalysisOptions = None,
+    on_progress=None,
+    journal: RunJournal = None,
+    completed: dict = None,
+    limiter: asyncio.Semaphore = None,
+) -> AnalysisResults:
+    """Analyze ``texts`` with up to ``options.concurrency`` requests in flight.
+
+    Rows with the same normalized text are analyzed once and the result is
+    copied to every matching row. With the analyzer's near-duplicate index,
+    near-identical texts are merged as well, and ``results.cluster_ids``
+    records the row whose result each row carries. The unique texts are processed in chunks
+    of ``options.batch_size``: each chunk is moderated with a single batched
+    request while the aggressiveness requests for its rows run alongside
+    it, ``options.score_batch_size`` posts per chat completion (or one
+    single-token request per post in score-only mode). When the analyzer
+    has a cascade policy, moderation runs first and only the posts it
+    leaves undecided are sent to the chat model. Posts the analyzer's
+    prefilter routes as benign get a benign record without any API call.
+    With a local backend, posts it answers confidently are recorded from
+    the local model and only the rest are sent to the API.
+    ``on_progress(done, total)`` is called after every completed chunk.
+
+    Rows listed in ``completed`` (index -> record, e.g. loaded from a
+    journal) are not requested again. Every newly completed row is
+    appended to ``journal`` when one is given. ``limiter`` replaces the
+    per-call concurrency limit so several calls can share one budget; it
+    covers moderation and chat requests alike.
+    """
+    options = options or AnalysisOptions()
+    batch_size = options.batch_size
+    total = len(texts)
+    results = AnalysisResults(total)
+    completed = completed or {}
+    for index, record in completed.items():
+        results.set(index, record)
+    results.resumed_rows = len(completed)
+    pending = [i for i in range(total) if i not in completed]
+    unique_texts, groups = group_duplicates([texts[i] for i in pending])
+    groups = [[pending[i] for i in group] for group in groups]
+    if analyzer.near_duplicates is not None:
+        unique_texts, groups = await asyncio.to_thread(analyzer.near_duplicates.merge, unique_texts, groups)
+        results.set_clusters(groups)
+    results.unique_rows = len(unique_texts)
+    done = len(completed)
+    if analyzer.prefilter is not None:
+        benign = benign_record(options.score_mode == SCORE_MODE_SCORE_ONLY)
+        kept_texts = []
+        kept_groups = []
+        for text, group in zip(unique_texts, groups):
+            if analyzer.prefilter.is_benign(text):
+                for index in group:
+                    results.set(index, benign)
+                    if journal is not None:
+                        journal.append(index, benign)
+                    done += 1
+            else:
+                kept_texts.append(text)
+                kept_groups.append(group)
+        unique_texts, groups = kept_texts, kept_groups
+    if analyzer.local_backend is not None and unique_texts:
+        decisions = await asyncio.to_thread(analyzer.local_backend.decide_many, unique_texts)
+        kept_texts = []
+        kept_groups = []
+        for text, group, decision in zip(unique_texts, groups, decisions):
+            if decision is None:
+                kept_texts.append(text)
+                kept_groups.append(group)
+                continue
+            record = local_record(decision, options.score_mode == SCORE_MODE_SCORE_ONLY)
+            for index in group:
+                results.set(index, record)
+                if journal is not None:
+                    journal.append(index, record)
+                done += 1
+        unique_texts, groups = kept_texts, kept_groups
+    chunks = iter(range(0, len(unique_texts), batch_size))
+    chat_slots = limiter or asyncio.Semaphore(options.concurrency)
+
+    async def moderate(batch):
+        async with chat_slots:
+            return await analyzer.moderate_many(batch, batch_size)
+
+    async def score(text):
+        async with chat_slots:
+            score_value, reason = await analyzer.get_aggressiveness_score(
+                text, options.temperature, options.top_p)
+        return score_value, reason, None
+
+    async def score_fast(text):
+        async with chat_slots:
+            score_value, expected = await analyzer.get_aggressiveness_score_fast(
+                text, options.temperature, options.top_p)
+        reason = None
+        if score_value is not None and score_value >= options.reason_threshold:
+            async with chat_slots:
+                reason = await analyzer.get_aggressiveness_reason(
+                    text, score_value, options.temperature, options.top_p)
+        return score_value, reason, expected
+
+    async def score_group(group):
+        async with chat_slots:
+            scored = await analyzer.score_many(group, options.temperature, options.top_p)
+        return [(score_value, reason, None) for score_value, reason in scored]
+
+    async def score_chunk(batch):
+        if options.score_mode == SCORE_MODE_SCORE_ONLY:
+            return await asyncio.gather(*(score_fast(text) for text in batch))
+        if options.score_batch_size <= 1:
+            return await asyncio.gather(*(score(text) for text in batch))
+        size = options.score_batch_size
+        scored = await asyncio.gather(*(
+            score_group(batch[i:i + size]) for i in range(0, len(batch), size)
+        ))
+        return [result for group in scored for result in group]
+
+    async def analyze_chunk(batch):
+        if analyzer.cascade is None:
+            moderation, scored = await asyncio.gather(
+                moderate(batch),
+                score_chunk(batch),
+            )
+            return [
+                make_record(cats, scores, score_value, reason, expected)
+                for (cats, scores), (score_value, reason, expected) in zip(moderation, scored)
+            ]
+        moderation = await moderate(batch)
+        decisions = [
+            analyzer.cascade.decide(scores) if scores is not None else None
+            for _, scores in moderation
+        ]
+        undecided = [i for i, decision in enumerate(decisions) if decision is None]
+        scored = dict(zip(undecided, await score_chunk([batch[i] for i in undecided])))
+        records = []
+        for i, (cats, scores) in enumerate(moderation):
+            if decisions[i] is None:
+                records.append(make_record(cats, scores, *scored[i]))
+            else:
+                score_value, reason, decided_by = decisions[i]
+                expected = float(score_value) if options.score_mode == SCORE_MODE_SCORE_ONLY else None
+                records.append(make_record(cats, scores, score_value, reason, expected, decided_by))
+        return records
+
+    async def worker():
+        nonlocal done
+        for start in chunks:
+            batch = unique_texts[start:start + batch_size]
+            for offset, record in enumerate(await analyze_chunk(batch)):
+                for index in groups[start + offset]:
+                    results.set(index, record)
+                    if journal is not None and is_complete(record):
+                        journal.append(index, record)
+                    done += 1
+            if journal is not None:
+                journal.flush()
+            if on_progress is not None:
+                on_progress(done, total)
+
+    workers = max(1, min(options.concurrency, -(-len(unique_texts) // batch_size)))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return results
+
+
+async def analyze_stream(
+    analyzer: TextAnalyzer,
+    chunks,
+    options: AnalysisOptions = None,
+    on_progress=None,
+    window: int = 2,
+):
+    """Analyze an iterable of text chunks and yield results in input order.
+
+    Up to ``window`` chunks are analyzed at once under a shared concurrency
+    limit, so the API stays busy while a finished chunk is being written.
+    Chunks are pulled from ``chunks`` in a worker thread because reading a
+    file blocks. Yields ``(texts, results)`` per chunk and calls
+    ``on_progress(done, None)`` as chunks finish.
+    """
+    options = options or AnalysisOptions()
+    limiter = asyncio.Semaphore(options.concurrency)
+    chunks = iter(chunks)
+    pending = collections.deque()
+    done = 0
+
+    async def submit():
+        texts = await asyncio.to_thread(next, chunks, None)
+        if texts is None:
+            return
+        task = asyncio.ensure_future(analyze_rows(analyzer, texts, options, limiter=limiter))
+        pending.append((texts, task))
+
+    for _ in range(window):
+        await submit()
+    while pending:
+        texts, task = pending.popleft()
+        results = await task
+        await submit()
+        if results.cluster_ids is not None:
+            # cluster ids name rows of the whole input, not of the chunk
+            results.cluster_ids[results.cluster_ids >= 0] += done
+        done += len(texts)
+        if on_progress is not None:
+            on_progress(done, None)
+        yield texts, results
@@ -0,0 +1,225 @@
+import argparse
+import os
+import sys
+import unicodedata
+from collections import deque
+
+from config import DEFAULT_PREFILTER_SETTINGS
+
+BENIGN_REASON = "ローカル事前判定でリスク語が見つからず、無害と判断したため。"
+
+# characters that carry no words: emoji, symbols, punctuation, joiners and variation selectors
+_SYMBOL_CATEGORIES = {"So", "Sk", "Sm", "Cf", "Mn", "Me", "Po", "Ps", "Pe", "Pd", "Pc", "Pi", "Pf", "Zs"}
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def fold_text(text) -> str:
+    """Return ``text`` folded for lexicon matching.
+
+    Applies NFKC, case folding and katakana-to-hiragana conversion so that
+    ``シネ``, ``ｼﾈ`` and ``しね`` match the same entry.
+    """
+    if text is None:
+        return ""
+    return unicodedata.normalize("NFKC", str(text)).casefold().translate(_KATAKANA_TO_HIRAGANA)
+
+
+def is_symbol_only(text: str) -> bool:
+    """Return ``True`` if ``text`` consists only of emoji, symbols and punctuation."""
+    return all(unicodedata.category(ch) in _SYMBOL_CATEGORIES or ch.isspace() for ch in text)
+
+
+class AhoCorasick:
+    """Multi-pattern matcher that scans a text once for every pattern."""
+
+    def __init__(self, patterns):
+        """Build the automaton for ``patterns``."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build_failure_links()
+
+    def _add(self, pattern: str):
+        """Insert ``pattern`` into the trie."""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append(pattern)
+
+    def _build_failure_links(self):
+        """Compute failure links breadth-first and merge outputs."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[nxt] = self.goto[state].get(ch, 0)
+                if self.fail[nxt] == nxt:
+                    self.fail[nxt] = 0
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find_all(self, text: str) -> list:
+        """Return every pattern occurring in ``text`` (with repeats)."""
+        found = []
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.output[node]:
+                found.extend(self.output[node])
+        return found
+
+    def search(self, text: str) -> bool:
+        """Return ``True`` as soon as any pattern occurs in ``text``."""
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.output[node]:
+                return True
+        return False
+
+
+def lexicon_path(path: str) -> str:
+    """Return the lexicon ``path`` from the config; relative paths are next to this module."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def load_lexicon(path: str) -> list:
+    """Read one term per line from ``path``; blank lines and ``#`` comments are skipped."""
+    terms = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            term = line.split("#", 1)[0].strip()
+            if term:
+                terms.append(fold_text(term))
+    return terms
+
+
+class Prefilter:
+    """Route posts without risk signals to a benign result without API calls.
+
+    A post is benign when none of the lexicon terms occurs in it and it is
+    either symbol/emoji-only or at most ``max_length`` characters long
+    (``0`` disables the length check). Counters of every routing decision
+    are kept so hit rates can be compared against full runs.
+    """
+
+    def __init__(self, terms, max_length: int = DEFAULT_PREFILTER_SETTINGS["max_length"]):
+        """Compile ``terms`` into a matcher."""
+        self.terms = [fold_text(term) for term in terms]
+        self.matcher = AhoCorasick(self.terms)
+        self.max_length = max_length
+        self.checked = 0
+        self.benign = 0
+        self.lexicon_hits = 0
+        self.symbol_only = 0
+        self.too_long = 0
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "Prefilter":
+        """Create a prefilter from the ``prefilter`` section of the config."""
+        return cls(load_lexicon(lexicon_path(settings["lexicon"])), settings["max_length"])
+
+    def classify(self, text) -> str:
+        """Return ``"lexicon"``, ``"symbol_only"``, ``"too_long"`` or ``"benign"`` without counting."""
+        folded = fold_text(text)
+        if self.matcher.search(folded):
+            return "lexicon"
+        if is_symbol_only(folded):
+            return "symbol_only"
+        if self.max_length and len(folded) > self.max_length:
+            return "too_long"
+        return "benign"
+
+    def is_benign(self, text) -> bool:
+        """Return ``True`` if ``text`` can skip the API and update the counters."""
+        kind = self.classify(text)
+        self.checked += 1
+        if kind == "lexicon":
+            self.lexicon_hits += 1
+            return False
+        if kind == "too_long":
+            self.too_long += 1
+            return False
+        if kind == "symbol_only":
+            self.symbol_only += 1
+        self.benign += 1
+        return True
+
+    def stats_text(self) -> str:
+        """Return a short routing summary for status displays."""
+        rate = self.benign / self.checked if self.checked else 0.0
+        return (
+            f"事前判定: 無害 {self.benign}/{self.checked}件 ({rate:.1%}) "
+            f"リスク語 {self.lexicon_hits}件 絵文字のみ {self.symbol_only}件"
+        )
+
+
+def evaluate(prefilter: Prefilter, texts, scores, threshold: int = 3) -> dict:
+    """Compare prefilter routing with aggressiveness scores from a full run.
+
+    Returns counts of routed rows and how many rows the prefilter would have
+    called benign although the full run scored them at ``threshold`` or above.
+    """
+    report = {"rows": 0, "benign": 0, "lexicon": 0, "symbol_only": 0, "too_long": 0,
+              "benign_but_aggressive": 0, "aggressive": 0, "aggressive_caught": 0}
+    for text, score in zip(texts, scores):
+        kind = prefilter.classify(text)
+        report["rows"] += 1
+        report[kind] += 1
+        benign = kind in ("benign", "symbol_only")
+        if kind == "symbol_only":
+            report["benign"] += 1
+        aggressive = score is not None and score == score and score >= threshold
+        if aggressive:
+            report["aggressive"] += 1
+            if benign:
+                report["benign_but_aggressive"] += 1
+            else:
+                report["aggressive_caught"] += 1
+    routed = report["benign"]
+    report["benign_rate"] = routed / report["rows"] if report["rows"] else 0.0
+    report["miss_rate"] = report["benign_but_aggressive"] / routed if routed else 0.0
+    report["recall"] = report["aggressive_caught"] / report["aggressive"] if report["aggressive"] else 1.0
+    return report
+
+
+def main(argv=None) -> int:
+    """Print prefilter hit rates against a result file of a full run."""
+    from file_io import read_table
+
+    parser = argparse.ArgumentParser(description="事前判定をフル分析の結果と比較します")
+    parser.add_argument("results", help="result file written by a full analysis run (.xlsx, .parquet, .csv, .jsonl)")
+    parser.add_argument("--column", required=True, help="column containing the posts")
+    parser.add_argument("--lexicon", default=lexicon_path(DEFAULT_PREFILTER_SETTINGS["lexicon"]))
+    parser.add_argument("--max-length", type=int, default=DEFAULT_PREFILTER_SETTINGS["max_length"])
+    parser.add_argument("--threshold", type=int, default=3, help="score counted as aggressive")
+    args = parser.parse_args(argv)
+
+    df = read_table(args.results)
+    prefilter = Prefilter(load_lexicon(args.lexicon), args.max_length)
+    report = evaluate(prefilter, df[args.column].tolist(), df["aggressiveness_score"].tolist(), args.threshold)
+    for key, value in report.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import collections
+import queue
+import time
+
+# how often the UI drains the channel
+PROGRESS_INTERVAL_MS = 100
+# seconds of history used for the rows/sec estimate
+RATE_WINDOW = 5.0
+
+
+def format_duration(seconds: float) -> str:
+    """Return ``seconds`` as ``"1時間02分"``, ``"3分05秒"`` or ``"12秒"``."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}時間{minutes:02d}分"
+    if minutes:
+        return f"{minutes}分{seconds:02d}秒"
+    return f"{seconds}秒"
+
+
+class ProgressChannel:
+    """Hand progress from a worker thread to the UI thread.
+
+    The worker only puts events on a queue (``report``, ``finish``,
+    ``fail``); it never touches widgets. The UI thread calls ``drain`` on a
+    fixed timer, which folds all queued progress events into the latest
+    counters and returns the terminal event, if any. However many rows
+    complete between two ticks, the widgets are updated once per tick.
+    """
+
+    def __init__(self):
+        """Create an empty channel."""
+        self.queue = queue.SimpleQueue()
+        self.done = 0
+        self.total = None
+        self.started = time.monotonic()
+        self.samples = collections.deque([(self.started, 0)])
+
+    def report(self, done: int, total: int = None):
+        """Record that ``done`` of ``total`` rows are finished (worker side)."""
+        self.queue.put(("progress", done, total))
+
+    def finish(self, result):
+        """Signal that the worker completed with ``result`` (worker side)."""
+        self.queue.put(("finished", result))
+
+    def fail(self, exc: BaseException):
+        """Signal that the worker stopped with ``exc`` (worker side)."""
+        self.queue.put(("failed", exc))
+
+    def drain(self):
+        """Apply queued events and return the terminal event (UI side).
+
+        Returns
+        -------
+        tuple
+            ``("finished", result)``, ``("failed", exc)`` or ``None`` while
+            the worker is still running.
+        """
+        terminal = None
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "progress":
+                self.done, self.total = event[1], event[2]
+            else:
+                terminal = event
+        now = time.monotonic()
+        self.samples.append((now, self.done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > RATE_WINDOW:
+            self.samples.popleft()
+        return terminal
+
+    def rate(self) -> float:
+        """Return the rows finished per second over the last few seconds."""
+        if len(self.samples) < 2:
+            return 0.0
+        (start, first), (end, last) = self.samples[0], self.samples[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    def eta(self) -> float:
+        """Return the estimated seconds until all rows are done, or ``None``."""
+        rate = self.rate()
+        if self.total is None or rate <= 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def status_text(self, in_flight: int = 0, errors: int = 0) -> str:
+        """Return the progress line shown while the analysis runs."""
+        if self.total:
+            text = f"分析中... {self.done}/{self.total} ({self.done / self.total:.1%})"
+        else:
+            text = f"分析中... {self.done}件"
+        text += f" {self.rate():.1f}件/秒"
+        eta = self.eta()
+        if eta is not None:
+            text += f" 残り {format_duration(eta)}"
+        return f"{text} 処理中 {in_flight} エラー {errors}"
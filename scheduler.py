@@ -0,0 +1,257 @@
+import asyncio
+import random
+import re
+import time
+
+from config import DEFAULT_MAX_RETRIES
+from metrics import RunMetrics
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value) -> float:
+    """Parse a rate-limit reset value such as ``"1s"``, ``"6m0s"`` or ``"20ms"``.
+
+    Plain numbers are taken as seconds. Returns ``None`` when ``value``
+    cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def estimate_tokens(text) -> int:
+    """Return a conservative token estimate for ``text``.
+
+    Japanese text is close to one token per character, so the character
+    count is used as an upper bound.
+    """
+    return len(str(text)) if text is not None else 0
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Return ``True`` if a request that raised ``exc`` may succeed later."""
+    import openai
+
+    if isinstance(exc, openai.RateLimitError):
+        return getattr(exc, "code", None) != "insufficient_quota"
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409) or exc.status_code >= 500
+    return False
+
+
+def is_input_error(exc: Exception) -> bool:
+    """Return ``True`` if the request was rejected because of its input (400/422)."""
+    import openai
+
+    return isinstance(exc, (openai.BadRequestError, openai.UnprocessableEntityError))
+
+
+def error_cause(exc: Exception) -> str:
+    """Return a short label of why a request raised ``exc`` for metrics."""
+    import openai
+
+    if isinstance(exc, openai.RateLimitError):
+        return "quota" if getattr(exc, "code", None) == "insufficient_quota" else "rate_limit"
+    if isinstance(exc, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(exc, openai.APIConnectionError):
+        return "connection"
+    if isinstance(exc, openai.APIStatusError):
+        return "server_error" if exc.status_code >= 500 else f"status_{exc.status_code}"
+    return type(exc).__name__
+
+
+def retry_after(exc: Exception) -> float:
+    """Return the server-requested delay in seconds carried by ``exc``, if any.
+
+    Only ``retry-after(-ms)`` counts. The ``x-ratelimit-reset-*`` headers
+    give the time until the whole window refills (e.g. ``"6m0s"``), not
+    until the next request may succeed, so they are left to
+    ``_apply_headers``.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        delay = parse_duration(headers["retry-after-ms"])
+        return delay / 1000 if delay is not None else None
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """Refill ``per_minute`` units per minute; a limit of ``0`` disables it."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        """Create a bucket holding at most ``burst_seconds`` worth of budget."""
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    def _refill(self):
+        """Add the budget accumulated since the last update."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _get_lock(self) -> asyncio.Lock:
+        """Return a lock bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until ``amount`` units are available and take them."""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._get_lock():
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """Charge ``amount`` extra units (negative values refund)."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _Endpoint:
+    """Budget and cooldown state of one API endpoint."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Hold back every request to this endpoint for ``seconds``."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """Route API calls through per-endpoint rate limits and retry policy.
+
+    Each endpoint has a requests-per-minute and a tokens-per-minute bucket.
+    Transient failures (429, 5xx, connection errors) are retried with
+    exponential backoff and full jitter, or after the delay the server asks
+    for via ``Retry-After``; other errors are raised immediately. A 429 or
+    an exhausted ``x-ratelimit-remaining-*`` header pauses the whole
+    endpoint so concurrent requests do not pile onto the limit. Latency,
+    token usage, retries and failures of every call are recorded in
+    ``metrics``.
+    """
+
+    def __init__(
+        self,
+        limits: dict = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        """Create a scheduler from ``{endpoint: {"rpm": .., "tpm": ..}}``."""
+        self.limits = limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.endpoints = {}
+        # read by the UI thread for live status; only plain ints are shared
+        self.in_flight = 0
+        self.failures = 0
+        self.metrics = RunMetrics()
+
+    def endpoint(self, name: str) -> _Endpoint:
+        """Return the state object of endpoint ``name``."""
+        if name not in self.endpoints:
+            limit = self.limits.get(name, {})
+            self.endpoints[name] = _Endpoint(limit.get("rpm", 0), limit.get("tpm", 0))
+        return self.endpoints[name]
+
+    def cooldown(self) -> float:
+        """Return the seconds until every paused endpoint accepts requests again."""
+        now = time.monotonic()
+        return max((endpoint.paused_until - now for endpoint in self.endpoints.values()), default=0.0)
+
+    def backoff(self, attempt: int) -> float:
+        """Return a jittered exponential delay for retry number ``attempt``."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, name: str, request, tokens: int = 0, max_retries: int = None):
+        """Run ``request()`` against endpoint ``name`` and return the parsed result.
+
+        ``request`` must return a coroutine. When it resolves to a raw
+        response (``with_raw_response``) its rate-limit headers are applied
+        and the parsed body is returned.
+        """
+        endpoint = self.endpoint(name)
+        retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            delay = endpoint.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await endpoint.requests.acquire(1)
+            await endpoint.tokens.acquire(tokens)
+            started = time.monotonic()
+            try:
+                response = await self._send(request)
+            except Exception as exc:
+                if not is_retryable(exc) or attempt >= retries:
+                    self.failures += 1
+                    self.metrics.record_failure(name, error_cause(exc))
+                    raise
+                self.metrics.record_retry(name, error_cause(exc))
+                delay = retry_after(exc)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if error_cause(exc) == "rate_limit":
+                    endpoint.pause(delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            parsed = self._apply_headers(endpoint, response)
+            self.metrics.record_request(name, time.monotonic() - started, getattr(parsed, "usage", None))
+            return parsed
+
+    async def _send(self, request):
+        """Await ``request()`` while counting it as in flight."""
+        self.in_flight += 1
+        try:
+            return await request()
+        finally:
+            self.in_flight -= 1
+
+    def _apply_headers(self, endpoint: _Endpoint, response):
+        """Honor rate-limit headers of a raw response and return its parsed body."""
+        headers = getattr(response, "headers", None)
+        if headers is None or not hasattr(response, "parse"):
+            return response
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    endpoint.pause(reset)
+        return response.parse()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# weight key -> (result column, whether the column is a boolean flag)
+WEIGHT_COLUMNS = {
+    "hate_score": ("hate_score", False),
+    "hate/threatening_score": ("hate/threatening_score", False),
+    "violence_score": ("violence_score", False),
+    "sexual_score": ("sexual_score", False),
+    "sexual/minors_score": ("sexual/minors_score", False),
+    "aggressiveness_score": ("aggressiveness_score", False),
+    "flag_hate": ("hate_flag", True),
+    "flag_hate/threatening": ("hate/threatening_flag", True),
+    "flag_violence": ("violence_flag", True),
+    "flag_sexual": ("sexual_flag", True),
+}
+
+
+def build_score_matrix(df: pd.DataFrame) -> np.ndarray:
+    """Return the ``(rows, len(WEIGHT_COLUMNS))`` matrix used for scoring.
+
+    Missing columns and missing values count as ``0``; flags become ``0``/``1``.
+    """
+    matrix = np.zeros((len(df), len(WEIGHT_COLUMNS)), dtype=np.float64, order="F")
+    for j, (column, is_flag) in enumerate(WEIGHT_COLUMNS.values()):
+        if column not in df:
+            continue
+        if is_flag:
+            matrix[:, j] = df[column].fillna(False).astype(bool).to_numpy()
+        else:
+            matrix[:, j] = pd.to_numeric(df[column], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    return matrix
+
+
+def weight_vector(weights: dict) -> np.ndarray:
+    """Return ``weights`` ordered like the columns of the score matrix."""
+    return np.array([float(weights.get(key, 0)) for key in WEIGHT_COLUMNS], dtype=np.float64)
+
+
+def total_score(matrix: np.ndarray, weights: dict) -> np.ndarray:
+    """Return the weighted aggression score of every row of ``matrix``."""
+    return matrix @ weight_vector(weights)
+
+
+def compute_total_score(df: pd.DataFrame, weights: dict) -> np.ndarray:
+    """Return the weighted aggression score of every row of ``df``."""
+    return total_score(build_score_matrix(df), weights)
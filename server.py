@@ -0,0 +1,351 @@
+"""HTTP scoring service for calling the analysis from other backends.
+
+Exposes ``TextAnalyzer`` and the weighted ``total_aggression`` as a JSON
+endpoint::
+
+    python server.py --port 8090
+    curl -s http://127.0.0.1:8090/v1/score -d '{"texts": ["今日の映画は最悪だった"]}'
+
+Posts of concurrent requests are coalesced into micro-batches of at most
+``server.max_batch_size`` posts, waiting at most ``server.max_wait_ms``
+for a batch to fill, and each batch goes through ``analyze_rows`` so it
+shares moderation requests, chat batching, the cache and the rate limits.
+``GET /v1/metrics`` returns the run report with the latency of every API
+and HTTP endpoint, ``GET /metrics`` the same in Prometheus format.
+``--mock`` answers from ``mock_server.py`` instead of the OpenAI API.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from http import HTTPStatus
+
+from analyzer import TextAnalyzer, build_analyzer
+from config import CONFIG_FILE, DEFAULT_WEIGHTS, ConfigManager
+from metrics import RunMetrics
+from pipeline import AnalysisOptions, analyze_rows
+
+ROUTES = ("/v1/score", "/v1/metrics", "/metrics", "/healthz")
+
+
+def scored_records(results, weights: dict) -> list:
+    """Return the result record of every row of ``results`` with its ``total_aggression``."""
+    from scoring import compute_total_score
+
+    totals = compute_total_score(results.frame(), weights)
+    return [{**results.record(i), "total_aggression": float(totals[i])} for i in range(results.size)]
+
+
+class MicroBatcher:
+    """Coalesce posts submitted by concurrent requests into batches.
+
+    A batch is started as soon as ``max_batch_size`` posts are waiting or
+    ``max_wait`` seconds after the first of them arrived. Batches run
+    concurrently under one limit of ``options.concurrency`` chat requests.
+    """
+
+    def __init__(
+        self,
+        analyzer: TextAnalyzer,
+        options: AnalysisOptions = None,
+        weights: dict = None,
+        max_batch_size: int = 32,
+        max_wait: float = 0.02,
+    ):
+        """Store the analysis settings; call ``start`` on the serving loop."""
+        self.analyzer = analyzer
+        self.options = options or AnalysisOptions()
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = collections.deque()
+        self.ready = None
+        self.full = None
+        self.limiter = None
+        self.task = None
+        self.running = set()
+        self.batches = 0
+        self.batched_posts = 0
+
+    def start(self):
+        """Start collecting batches on the running loop."""
+        self.ready = asyncio.Event()
+        self.full = asyncio.Event()
+        self.limiter = asyncio.Semaphore(self.options.concurrency)
+        self.task = asyncio.ensure_future(self._collect())
+
+    async def close(self):
+        """Stop collecting and wait for the batches in flight."""
+        self.task.cancel()
+        await asyncio.gather(self.task, *self.running, return_exceptions=True)
+
+    async def score(self, texts: list) -> list:
+        """Return the scored record of every post in ``texts``."""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        arrived = loop.time()
+        futures = [loop.create_future() for _ in texts]
+        self.pending.extend((text, future, arrived) for text, future in zip(texts, futures))
+        self.ready.set()
+        if len(self.pending) >= self.max_batch_size:
+            self.full.set()
+        return await asyncio.gather(*futures)
+
+    async def _collect(self):
+        """Cut waiting posts into batches and start each one."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            # the wait is measured from the arrival of the oldest waiting post
+            remaining = self.pending[0][2] + self.max_wait - loop.time()
+            if len(self.pending) < self.max_batch_size and remaining > 0:
+                try:
+                    await asyncio.wait_for(self.full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            size = min(len(self.pending), self.max_batch_size)
+            batch = [self.pending.popleft() for _ in range(size)]
+            if not self.pending:
+                self.ready.clear()
+            if len(self.pending) < self.max_batch_size:
+                self.full.clear()
+            task = asyncio.ensure_future(self._run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch: list):
+        """Analyze one batch and resolve the futures of its posts."""
+        self.batches += 1
+        self.batched_posts += len(batch)
+        try:
+            results = await analyze_rows(self.analyzer, [text for text, _, _ in batch], self.options, limiter=self.limiter)
+            records = scored_records(results, self.weights)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), record in zip(batch, records):
+            if not future.done():
+                future.set_result(record)
+
+    def stats(self) -> dict:
+        """Return the number of batches and their mean size."""
+        return {
+            "batches": self.batches,
+            "posts": self.batched_posts,
+            "mean_batch_size": self.batched_posts / self.batches if self.batches else None,
+        }
+
+
+class ModerationServer:
+    """Minimal HTTP/1.1 JSON server in front of a ``MicroBatcher``."""
+
+    def __init__(
+        self,
+        batcher: MicroBatcher,
+        metrics: RunMetrics,
+        host: str = "127.0.0.1",
+        port: int = 8090,
+        max_body_bytes: int = 1_000_000,
+    ):
+        """Store the batcher, the metrics every request is recorded in and the address."""
+        self.batcher = batcher
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.server = None
+        self.connections = set()
+
+    @property
+    def url(self) -> str:
+        """Return the base URL of the running server."""
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> str:
+        """Start listening on the current loop and return ``url``."""
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.url
+
+    async def close(self):
+        """Stop accepting requests and finish the batches in flight."""
+        self.server.close()
+        for task in self.connections:
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+        await self.batcher.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer requests on one keep-alive connection."""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                route = path.split("?", 1)[0]
+                started = time.monotonic()
+                if length > self.max_body_bytes:
+                    status, content_type, data = self.error(413, "リクエストが大きすぎます")
+                else:
+                    body = await reader.readexactly(length)
+                    status, content_type, data = await self.respond(method, route, body)
+                # unknown paths share one label so scanners cannot grow the metrics
+                endpoint = f"http {route if route in ROUTES else 'other'}"
+                if status < 400:
+                    self.metrics.record_request(endpoint, time.monotonic() - started)
+                else:
+                    self.metrics.record_failure(endpoint, f"status_{status}")
+                await self._write(writer, status, content_type, data)
+                if status == 413 or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            # malformed requests and shutdown just drop the connection
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, status: int, content_type: str, data: bytes):
+        """Send one response."""
+        reason = HTTPStatus(status).phrase
+        head = f"HTTP/1.1 {status} {reason}\r\ncontent-type: {content_type}\r\ncontent-length: {len(data)}\r\n\r\n"
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    @staticmethod
+    def error(status: int, message: str) -> tuple:
+        """Return an error response."""
+        return status, "application/json", json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+
+    async def respond(self, method: str, path: str, body: bytes) -> tuple:
+        """Return ``(status, content_type, data)`` for a request to ``path``."""
+        if path == "/healthz":
+            return 200, "text/plain", b"ok\n"
+        if path == "/metrics" and method == "GET":
+            return 200, "text/plain; version=0.0.4", self.metrics_text().encode("utf-8")
+        if path == "/v1/metrics" and method == "GET":
+            return 200, "application/json", json.dumps(self.report(), ensure_ascii=False).encode("utf-8")
+        if path != "/v1/score":
+            return self.error(404, f"見つかりません: {path}")
+        if method != "POST":
+            return self.error(405, "POST で送信してください")
+        try:
+            payload = json.loads(body or b"{}")
+            single = "text" in payload
+            texts = [payload["text"]] if single else payload["texts"]
+            if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+                raise TypeError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.error(400, '{"text": "..."} または1件以上の {"texts": ["...", ...]} を送信してください')
+        try:
+            records = await self.batcher.score(texts)
+        except Exception as e:
+            return self.error(502, f"{type(e).__name__}: {e}")
+        reply = records[0] if single else {"results": records}
+        return 200, "application/json", json.dumps(reply, ensure_ascii=False).encode("utf-8")
+
+    def report(self) -> dict:
+        """Return the run report since the server started, with batching figures."""
+        self.metrics.finish(self.batcher.batched_posts)
+        return {**self.metrics.report(), "batching": self.batcher.stats()}
+
+    def metrics_text(self) -> str:
+        """Return the metrics in Prometheus format, with batching figures."""
+        self.metrics.finish(self.batcher.batched_posts)
+        stats = self.batcher.stats()
+        lines = [
+            "# TYPE uhalis_server_batches_total counter",
+            f"uhalis_server_batches_total {stats['batches']}",
+            "# TYPE uhalis_server_batched_posts_total counter",
+            f"uhalis_server_batched_posts_total {stats['posts']}",
+        ]
+        return self.metrics.prometheus_text() + "\n".join(lines) + "\n"
+
+
+async def serve(config: ConfigManager, host: str, port: int):
+    """Serve the scoring endpoint described by ``config`` until cancelled."""
+    settings = config.get_server_settings()
+    analyzer = build_analyzer(config)
+    metrics = analyzer.start_metrics(config.get_metrics_settings()["prices"])
+    batcher = MicroBatcher(
+        analyzer,
+        AnalysisOptions.from_config(config),
+        config.get_weights(),
+        settings["max_batch_size"],
+        settings["max_wait_ms"] / 1000,
+    )
+    server = ModerationServer(batcher, metrics, host, port, settings["max_body_bytes"])
+    print(f"moderation service listening on {await server.start()}", flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+        if analyzer.client is not None:
+            await analyzer.client.close()
+        if analyzer.cache is not None:
+            analyzer.cache.close()
+
+
+def main(argv=None) -> int:
+    """Run the scoring service in the foreground."""
+    from mock_server import add_server_arguments, server_from_args
+
+    parser = argparse.ArgumentParser(description="攻撃性判定のHTTPサービス")
+    parser.add_argument("--config", default=CONFIG_FILE, help="config.json with weights and parameters")
+    parser.add_argument("--host", help="address to listen on (default: server.host)")
+    parser.add_argument("--port", type=int, help="port to listen on (default: server.port)")
+    parser.add_argument("--max-batch-size", type=int, help="most posts analyzed in one micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, help="longest wait for a micro-batch to fill")
+    parser.add_argument("--mock", action="store_true", help="answer from a local mock API instead of OpenAI")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    config = ConfigManager(args.config)
+    server_settings = config.data.setdefault("server", {})
+    if args.max_batch_size is not None:
+        server_settings["max_batch_size"] = args.max_batch_size
+    if args.max_wait_ms is not None:
+        server_settings["max_wait_ms"] = args.max_wait_ms
+    settings = config.get_server_settings()
+    mock = None
+    if args.mock:
+        mock = server_from_args(args)
+        os.environ["OPENAI_BASE_URL"] = mock.start_in_thread()
+        os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+        # mock replies must not end up in the result cache
+        config.data.setdefault("cache", {})["enabled"] = False
+    try:
+        asyncio.run(serve(config, args.host or settings["host"], args.port or settings["port"]))
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if mock is not None:
+            mock.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+from analyzer import TextAnalyzer, build_analyzer, build_client
+from config import ConfigManager
+
+
+class AnalysisService:
+    """Run analysis jobs on one event loop that lives as long as the app.
+
+    The loop runs on a background thread and owns the analyzer with its
+    ``AsyncOpenAI`` client, so the keep-alive connections, rate-limit state
+    and loop setup are shared by every job instead of being rebuilt per
+    run. Jobs are coroutines submitted from any thread.
+    """
+
+    def __init__(self, config: ConfigManager, analyzer: TextAnalyzer = None):
+        """Start the loop thread and create the analyzer described by ``config``."""
+        self.config = config
+        self.analyzer = analyzer or build_analyzer(config)
+        self.pool_size = config.get_pool_size()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="analysis-service", daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> "AnalysisService":
+        """Return the running service."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Shut the service down."""
+        self.close()
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the service loop.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the coroutine's result or exception.
+        """
+        return asyncio.run_coroutine_threadsafe(self._run(coro), self.loop)
+
+    def run(self, coro):
+        """Run ``coro`` on the service loop and wait for its result."""
+        return self.submit(coro).result()
+
+    async def _run(self, coro):
+        """Resize the connection pool if the concurrency changed, then await ``coro``."""
+        size = self.config.get_pool_size()
+        if size != self.pool_size and self.analyzer.client is not None:
+            old = self.analyzer.client
+            self.analyzer.client = build_client(self.config, old.api_key)
+            self.pool_size = size
+            await old.close()
+        return await coro
+
+    async def _shutdown(self):
+        """Close the HTTP client on the loop it was used from."""
+        if self.analyzer.client is not None:
+            await self.analyzer.client.close()
+
+    def close(self):
+        """Close the client and cache and stop the loop thread."""
+        if not self.loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        if self.analyzer.cache is not None:
+            self.analyzer.cache.close()
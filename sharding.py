@@ -0,0 +1,191 @@
+"""Sharded execution of very large jobs across worker processes.
+
+The unique texts of a job are cut into chunks that worker processes pull
+from a shared queue. Every worker has its own event loop, analyzer and
+HTTP client, and optionally its own API key, base URL and rate limits from
+the ``sharding.key_pool`` section of ``config.json``. A worker whose key is
+being throttled stops pulling chunks until its cooldown has passed, so the
+remaining work flows to the keys that still have budget.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+
+from analyzer import build_analyzer
+from config import ConfigManager
+from journal import RunJournal
+from metrics import RunMetrics
+from pipeline import AnalysisOptions, AnalysisResults, analyze_rows, group_duplicates, is_complete
+
+# chunks each worker analyzes at once so its API budget stays busy
+WORKER_WINDOW = 2
+
+
+def resolve_key_pool(settings: dict) -> list:
+    """Return ``{"api_key", "base_url", "rate_limits"}`` for every configured key.
+
+    An empty pool means one key from ``OPENAI_API_KEY``. Raises
+    ``ValueError`` when an environment variable named in the pool is not set.
+    """
+    pool = settings["key_pool"] or [{"api_key_env": "OPENAI_API_KEY"}]
+    keys = []
+    for entry in pool:
+        name = entry.get("api_key_env", "OPENAI_API_KEY")
+        api_key = os.getenv(name)
+        if api_key is None:
+            raise ValueError(f"環境変数 '{name}' にAPIキーが設定されていません。")
+        keys.append({
+            "name": name,
+            "api_key": api_key,
+            "base_url": entry.get("base_url"),
+            "rate_limits": entry.get("rate_limits"),
+        })
+    return keys
+
+
+def _worker_main(worker_id: int, config_path: str, config_data: dict, key: dict, options, tasks, results):
+    """Process entry point: configure the key and run the worker loop."""
+    os.environ["OPENAI_API_KEY"] = key["api_key"]
+    if key["base_url"]:
+        os.environ["OPENAI_BASE_URL"] = key["base_url"]
+    config = ConfigManager(config_path)
+    config.data = config_data
+    if key["rate_limits"]:
+        config.data["rate_limits"] = key["rate_limits"]
+    # near-duplicates were already merged before the texts were distributed
+    config.set_neardup_enabled(False)
+    try:
+        asyncio.run(_worker_loop(worker_id, config, options, tasks, results))
+    except Exception as e:
+        results.put(("error", worker_id, f"{type(e).__name__}: {e}"))
+
+
+async def _worker_loop(worker_id: int, config: ConfigManager, options: AnalysisOptions, tasks, results):
+    """Pull chunks until the queue is drained and send back their records."""
+    analyzer = build_analyzer(config)
+    metrics = analyzer.start_metrics(config.get_metrics_settings()["prices"])
+    limiter = asyncio.Semaphore(options.concurrency)
+
+    async def consume():
+        while True:
+            # a throttled key leaves new chunks to the other workers
+            cooldown = analyzer.scheduler.cooldown()
+            if cooldown > 0:
+                await asyncio.sleep(cooldown)
+            task = await asyncio.to_thread(tasks.get)
+            if task is None:
+                return
+            start, texts = task
+            chunk = await analyze_rows(analyzer, texts, options, limiter=limiter)
+            results.put(("chunk", worker_id, start, [chunk.record(i) for i in range(len(texts))]))
+
+    await asyncio.gather(*(consume() for _ in range(WORKER_WINDOW)))
+    metrics.finish(0)
+    if analyzer.client is not None:
+        await analyzer.client.close()
+    results.put(("done", worker_id, metrics.report(), dict(metrics.endpoints)))
+
+
+def analyze_sharded(
+    config: ConfigManager,
+    texts: list,
+    options: AnalysisOptions = None,
+    on_progress=None,
+    journal: RunJournal = None,
+    completed: dict = None,
+    metrics: RunMetrics = None,
+):
+    """Analyze ``texts`` in worker processes and merge the results in row order.
+
+    Rows are deduplicated (and near-duplicates merged when enabled in
+    ``config``) before they are distributed, and rows listed in
+    ``completed`` are skipped as in ``analyze_rows``. Newly completed rows
+    are appended to ``journal``. ``on_progress(done, total)`` is called
+    after every merged chunk. The request metrics of every worker are
+    merged into ``metrics``.
+
+    Returns
+    -------
+    tuple
+        ``(results, reports)``: the merged ``AnalysisResults`` and the run
+        report of every worker, keyed by the name of its API key variable.
+    """
+    options = options or AnalysisOptions()
+    settings = config.get_sharding_settings()
+    keys = resolve_key_pool(settings)
+    workers = settings["workers"] or len(keys)
+    total = len(texts)
+    results = AnalysisResults(total)
+    completed = completed or {}
+    for index, record in completed.items():
+        results.set(index, record)
+    results.resumed_rows = len(completed)
+    pending = [i for i in range(total) if i not in completed]
+    unique_texts, groups = group_duplicates([texts[i] for i in pending])
+    groups = [[pending[i] for i in group] for group in groups]
+    neardup_settings = config.get_neardup_settings()
+    if neardup_settings["enabled"]:
+        from neardup import NearDuplicateIndex
+
+        unique_texts, groups = NearDuplicateIndex.from_settings(neardup_settings).merge(unique_texts, groups)
+        results.set_clusters(groups)
+    results.unique_rows = len(unique_texts)
+    done = len(completed)
+
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    replies = context.Queue()
+    chunk_size = settings["chunk_size"]
+    for start in range(0, len(unique_texts), chunk_size):
+        tasks.put((start, unique_texts[start:start + chunk_size]))
+    for _ in range(workers * WORKER_WINDOW):
+        tasks.put(None)
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(i, config.path, config.data, keys[i % len(keys)], options, tasks, replies),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    reports = {}
+    running = workers
+    try:
+        while running:
+            try:
+                message = replies.get(timeout=1.0)
+            except queue.Empty:
+                crashed = [p.exitcode for p in processes if p.exitcode not in (None, 0)]
+                if crashed:
+                    raise RuntimeError(f"worker process exited with code {crashed[0]}")
+                continue
+            if message[0] == "error":
+                raise RuntimeError(f"worker {message[1]} failed: {message[2]}")
+            if message[0] == "done":
+                name = keys[message[1] % len(keys)]["name"]
+                reports[f"{name}#{message[1]}"] = message[2]
+                if metrics is not None:
+                    metrics.merge(message[3])
+                running -= 1
+                continue
+            _, _, start, records = message
+            for offset, record in enumerate(records):
+                for index in groups[start + offset]:
+                    results.set(index, record)
+                    if journal is not None and is_complete(record):
+                        journal.append(index, record)
+                    done += 1
+            if journal is not None:
+                journal.flush()
+            if on_progress is not None:
+                on_progress(done, total)
+    finally:
+        for process in processes:
+            if running:
+                process.terminate()
+            process.join()
+    return results, reports
@@ -0,0 +1,108 @@
+"""Startup-time measurement of the GUI, to be tracked across releases.
+
+Starts ``main.py --startup-time`` under ``python -X importtime`` and
+reports the time until the first frame was drawn together with the
+slowest imports::
+
+    python startup_time.py --top 15
+    python startup_time.py --runs 5 --json startup.json
+
+``--module`` measures a plain import instead, e.g. ``--module cli`` on
+machines without a display.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# modules that should only be imported once the user loads a file or starts a run
+DEFERRED_MODULES = ("pandas", "numpy", "openai", "httpx")
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$")
+STARTUP_LINE = re.compile(r"^startup: ([\d.]+)s$")
+
+
+def parse_importtime(stderr: str) -> list:
+    """Return ``{"module", "self_us", "cumulative_us", "depth"}`` for every ``-X importtime`` line."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append({
+                "module": module.strip(),
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(indent) - 1) // 2,
+            })
+    return imports
+
+
+def measure(module: str = None) -> dict:
+    """Run one fresh interpreter and return its startup figures.
+
+    Returns
+    -------
+    dict
+        ``first_frame_seconds`` (``None`` with ``module``), the total
+        import time in seconds, the list of top-level imports and the
+        ``DEFERRED_MODULES`` that were imported anyway.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    if module:
+        command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    else:
+        command = [sys.executable, "-X", "importtime", os.path.join(here, "main.py"), "--startup-time"]
+    process = subprocess.run(command, cwd=here, capture_output=True, text=True, encoding="utf-8")
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "startup failed")
+    first_frame = None
+    for line in process.stderr.splitlines():
+        match = STARTUP_LINE.match(line)
+        if match:
+            first_frame = float(match.group(1))
+    imports = parse_importtime(process.stderr)
+    top_level = [entry for entry in imports if entry["depth"] == 0]
+    return {
+        "first_frame_seconds": first_frame,
+        "import_seconds": sum(entry["cumulative_us"] for entry in top_level) / 1_000_000,
+        "imports": top_level,
+        "deferred_imported": sorted({entry["module"] for entry in imports} & set(DEFERRED_MODULES)),
+    }
+
+
+def main(argv=None) -> int:
+    """Measure startup ``--runs`` times and print the median run."""
+    parser = argparse.ArgumentParser(description="起動時間の計測")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to start; the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--module", help="measure 'import MODULE' instead of opening the window")
+    parser.add_argument("--json", help="write the median run as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        runs = [measure(args.module) for _ in range(args.runs)]
+    except RuntimeError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    runs.sort(key=lambda run: run["first_frame_seconds"] or run["import_seconds"])
+    median = runs[len(runs) // 2]
+    if median["first_frame_seconds"] is not None:
+        frames = [run["first_frame_seconds"] for run in runs]
+        print(f"first frame: {statistics.median(frames):.3f}s (min {min(frames):.3f}s, max {max(frames):.3f}s)")
+    print(f"imports:     {median['import_seconds']:.3f}s")
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for entry in sorted(median["imports"], key=lambda e: e["cumulative_us"], reverse=True)[:args.top]:
+        print(f"{entry['cumulative_us'] / 1000:>13.1f} {entry['self_us'] / 1000:>8.1f}  {entry['module']}")
+    for module in median["deferred_imported"]:
+        print(f"warning: {module} is imported at startup", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(median, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,18 @@
-import asyncio
-import threading
-import pandas as pd
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 
-from analyzer import TextAnalyzer
-from config import ConfigManager
+from analyzer import CascadePolicy
+from config import BACKEND_HYBRID, BACKEND_LOCAL, BACKEND_OPENAI, SCORE_MODE_FULL, SCORE_MODE_SCORE_ONLY, ConfigManager
+from file_io import TABLE_FORMATS, file_types, read_columns, read_table, sheet_names, write_table
+from jobs import JOB_FAILED, AnalysisJob, job_output_path, run_jobs
+from journal import RunJournal
+from metrics import report_path
+from prefilter import Prefilter
+from pipeline import AnalysisOptions, analyze_rows
+from progress import PROGRESS_INTERVAL_MS, ProgressChannel
+
+# pandas, numpy and openai are imported on first use so the window appears
+# without waiting for them; see ``startup_time.py``.
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
@@ -13,17 +20,36 @@ ctk.set_default_color_theme("blue")
 class ModerationApp(ctk.CTk):
     """GUI application for running text moderation."""
 
-    def __init__(self, analyzer: TextAnalyzer, config: ConfigManager):
-        """Create the application and build the UI."""
+    def __init__(self, config: ConfigManager, service=None):
+        """Create the application and build the UI.
+
+        Analyses run as jobs on ``service``, whose event loop and HTTP
+        connections are kept for the lifetime of the window. Without one,
+        the service is created when the first analysis starts.
+        """
         super().__init__()
-        self.analyzer = analyzer
+        self.service = service
+        self.analyzer = service.analyzer if service is not None else None
         self.config = config
         self.df = None
+        self.file_path = None
+        self.score_matrix = None
         self.temperature = config.get_temperature()
         self.top_p = config.get_top_p()
-        self.weights = config.data.get("weights", {})
+        self.concurrency = config.get_concurrency()
+        self.batch_size = config.get_moderation_batch_size()
+        self.score_batch_size = config.get_score_batch_size()
+        self.reason_threshold = config.get_reason_threshold()
+        self.weights = config.get_weights()
         self.updating_weights = False
         self.create_ui()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        """Stop the analysis service and close the window."""
+        if self.service is not None:
+            self.service.close()
+        self.destroy()
 
     def create_ui(self):
         """Initialize all widgets for both tabs."""
@@ -33,6 +59,7 @@ class ModerationApp(ctk.CTk):
         self.tabview = ctk.CTkTabview(self)
         self.tabview.pack(fill="both", expand=True, padx=20, pady=20)
         self.main_tab = self.tabview.add("メイン")
+        self.queue_tab = self.tabview.add("ジョブキュー")
         self.settings_tab = self.tabview.add("設定")
 
         # main tab widgets
@@ -42,6 +69,9 @@ class ModerationApp(ctk.CTk):
         self.upload_button = ctk.CTkButton(self.main_tab, text="ファイルを選択", command=self.load_excel_file)
         self.upload_button.pack(pady=5)
 
+        self.resume_button = ctk.CTkButton(self.main_tab, text="中断した分析を再開", command=self.resume_analysis)
+        self.resume_button.pack(pady=5)
+
         self.column_combo = ctk.CTkComboBox(self.main_tab, values=[])
         self.column_combo.pack(pady=5)
 
@@ -55,6 +85,8 @@ class ModerationApp(ctk.CTk):
         self.progress_bar.pack(pady=20)
         self.progress_bar.set(0)
 
+        self.create_queue_tab()
+
         # settings tab widgets
         param_frame = ctk.CTkFrame(self.settings_tab)
         param_frame.pack(pady=10)
@@ -69,6 +101,57 @@ class ModerationApp(ctk.CTk):
         self.top_p_entry.grid(row=0, column=3, padx=10)
         self.top_p_entry.insert(0, str(self.top_p))
 
+        ctk.CTkLabel(param_frame, text="同時実行数").grid(row=1, column=0, padx=10, pady=5)
+        self.concurrency_entry = ctk.CTkEntry(param_frame, width=60)
+        self.concurrency_entry.grid(row=1, column=1, padx=10)
+        self.concurrency_entry.insert(0, str(self.concurrency))
+
+        ctk.CTkLabel(param_frame, text="モデレーション一括件数").grid(row=1, column=2, padx=10)
+        self.batch_size_entry = ctk.CTkEntry(param_frame, width=60)
+        self.batch_size_entry.grid(row=1, column=3, padx=10)
+        self.batch_size_entry.insert(0, str(self.batch_size))
+
+        ctk.CTkLabel(param_frame, text="攻撃性一括件数").grid(row=2, column=0, padx=10, pady=5)
+        self.score_batch_entry = ctk.CTkEntry(param_frame, width=60)
+        self.score_batch_entry.grid(row=2, column=1, padx=10)
+        self.score_batch_entry.insert(0, str(self.score_batch_size))
+
+        self.score_only_var = ctk.BooleanVar(value=self.config.get_score_mode() == SCORE_MODE_SCORE_ONLY)
+        ctk.CTkCheckBox(param_frame, text="スコアのみ (高速)", variable=self.score_only_var).grid(
+            row=3, column=0, columnspan=2, padx=10, pady=5, sticky="w"
+        )
+
+        self.cascade_var = ctk.BooleanVar(value=self.config.get_cascade_settings()["enabled"])
+        ctk.CTkCheckBox(param_frame, text="カスケード判定", variable=self.cascade_var).grid(
+            row=4, column=0, columnspan=2, padx=10, pady=5, sticky="w"
+        )
+
+        self.prefilter = None
+        self.prefilter_var = ctk.BooleanVar(value=self.config.get_prefilter_settings()["enabled"])
+        ctk.CTkCheckBox(param_frame, text="ローカル事前判定", variable=self.prefilter_var).grid(
+            row=4, column=2, columnspan=2, padx=10, pady=5, sticky="w"
+        )
+
+        ctk.CTkLabel(param_frame, text="判定バックエンド").grid(row=5, column=0, padx=10, pady=5)
+        self.backend_combo = ctk.CTkOptionMenu(param_frame, values=[BACKEND_OPENAI, BACKEND_HYBRID, BACKEND_LOCAL])
+        self.backend_combo.grid(row=5, column=1, columnspan=2, padx=10, sticky="w")
+        self.backend_combo.set(self.config.get_local_model_settings()["backend"])
+
+        neardup_settings = self.config.get_neardup_settings()
+        self.neardup_var = ctk.BooleanVar(value=neardup_settings["enabled"])
+        ctk.CTkCheckBox(param_frame, text="類似投稿をまとめて判定", variable=self.neardup_var).grid(
+            row=6, column=0, columnspan=2, padx=10, pady=5, sticky="w"
+        )
+        ctk.CTkLabel(param_frame, text="類似度しきい値").grid(row=6, column=2, padx=10)
+        self.similarity_entry = ctk.CTkEntry(param_frame, width=60)
+        self.similarity_entry.grid(row=6, column=3, padx=10)
+        self.similarity_entry.insert(0, str(neardup_settings["threshold"]))
+
+        ctk.CTkLabel(param_frame, text="理由生成しきい値").grid(row=3, column=2, padx=10)
+        self.reason_threshold_entry = ctk.CTkEntry(param_frame, width=60)
+        self.reason_threshold_entry.grid(row=3, column=3, padx=10)
+        self.reason_threshold_entry.insert(0, str(self.reason_threshold))
+
         self.weight_frame = ctk.CTkFrame(self.settings_tab)
         self.weight_frame.pack(pady=10, fill="x")
         self.weight_sliders = {}
@@ -89,39 +172,313 @@ class ModerationApp(ctk.CTk):
         self.remaining_weight_label.pack(pady=5)
         self.update_weight_info()
 
+    def create_queue_tab(self):
+        """Initialize the job queue tab: one row per file and sheet."""
+        self.jobs = []
+        self.job_rows = {}
+        button_frame = ctk.CTkFrame(self.queue_tab)
+        button_frame.pack(pady=5)
+        self.queue_add_button = ctk.CTkButton(button_frame, text="ファイルを追加", command=self.add_queue_files)
+        self.queue_add_button.grid(row=0, column=0, padx=5)
+        self.queue_clear_button = ctk.CTkButton(button_frame, text="キューを空にする", command=self.clear_queue)
+        self.queue_clear_button.grid(row=0, column=1, padx=5)
+        self.queue_run_button = ctk.CTkButton(
+            button_frame, text="キューを実行", state="disabled", command=self.start_queue
+        )
+        self.queue_run_button.grid(row=0, column=2, padx=5)
+        ctk.CTkLabel(button_frame, text="出力形式").grid(row=0, column=3, padx=5)
+        self.queue_format_menu = ctk.CTkOptionMenu(
+            button_frame, values=[ext for ext in TABLE_FORMATS if ext != ".ndjson"], width=90
+        )
+        self.queue_format_menu.grid(row=0, column=4, padx=5)
+        self.queue_format_menu.set(".xlsx")
+        self.queue_status_label = ctk.CTkLabel(self.queue_tab, text="分析するファイルを追加してください")
+        self.queue_status_label.pack(pady=5)
+        self.queue_frame = ctk.CTkScrollableFrame(self.queue_tab)
+        self.queue_frame.pack(fill="both", expand=True, padx=5, pady=5)
+
+    def add_queue_files(self):
+        """Add a job for every sheet of the chosen files."""
+        paths = filedialog.askopenfilenames(filetypes=file_types())
+        for path in paths:
+            try:
+                for sheet in sheet_names(path):
+                    self.add_job_row(AnalysisJob(path, None, sheet), read_columns(path, sheet))
+            except Exception as e:
+                messagebox.showerror("読み込みエラー", f"{path}: {e}")
+        if self.jobs:
+            self.queue_run_button.configure(state="normal")
+            self.queue_status_label.configure(text=f"{len(self.jobs)}件のジョブ", text_color="white")
+
+    def add_job_row(self, job: AnalysisJob, columns: list):
+        """Show ``job`` with its column selector, progress bar and status."""
+        row = len(self.jobs)
+        ctk.CTkLabel(self.queue_frame, text=job.label).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+        column_menu = ctk.CTkOptionMenu(self.queue_frame, values=[str(c) for c in columns] or [""], width=140)
+        column_menu.grid(row=row, column=1, padx=5)
+        selected = self.column_combo.get()
+        column_menu.set(selected if selected in map(str, columns) else str(columns[0]) if columns else "")
+        progress_bar = ctk.CTkProgressBar(self.queue_frame, width=150)
+        progress_bar.grid(row=row, column=2, padx=5)
+        progress_bar.set(0)
+        status = ctk.CTkLabel(self.queue_frame, text="待機中")
+        status.grid(row=row, column=3, padx=5, sticky="w")
+        self.jobs.append(job)
+        self.job_rows[id(job)] = (column_menu, progress_bar, status, None)
+
+    def clear_queue(self):
+        """Remove all jobs from the queue tab."""
+        for widget in self.queue_frame.winfo_children():
+            widget.destroy()
+        self.jobs = []
+        self.job_rows = {}
+        self.queue_run_button.configure(state="disabled")
+        self.queue_status_label.configure(text="分析するファイルを追加してください", text_color="white")
+
+    def start_queue(self):
+        """Submit every queued job to the analysis service as one run.
+
+        Jobs share the service's analyzer and one concurrency limit; each
+        job reports through its own ``ProgressChannel`` and writes its own
+        output file next to its input.
+        """
+        if not self.jobs or not self.ensure_service() or not self.validate_parameters():
+            return
+        extension = self.queue_format_menu.get()
+        for job in self.jobs:
+            column_menu, progress_bar, status, _ = self.job_rows[id(job)]
+            job.column = column_menu.get()
+            job.output_path = job_output_path(job.input_path, job.sheet, extension)
+            self.job_rows[id(job)] = (column_menu, progress_bar, status, ProgressChannel())
+            column_menu.configure(state="disabled")
+            progress_bar.set(0)
+            status.configure(text="待機中", text_color="white")
+        for button in (self.queue_add_button, self.queue_clear_button, self.queue_run_button,
+                       self.upload_button, self.resume_button, self.analyze_button):
+            button.configure(state="disabled")
+        self.finished_jobs = set()
+        self.failures_before = self.analyzer.scheduler.failures
+        self.metrics = self.analyzer.start_metrics(self.config.get_metrics_settings()["prices"])
+        self.queue_future = self.service.submit(run_jobs(
+            self.analyzer,
+            self.jobs,
+            AnalysisOptions.from_config(self.config),
+            {k: slider.get() for k, slider in self.weight_sliders.items()},
+            lambda job, done, total: self.job_rows[id(job)][3].report(done, total),
+            self.post_job_outcome,
+        ))
+        self.after(PROGRESS_INTERVAL_MS, self.poll_queue)
+
+    def post_job_outcome(self, job: AnalysisJob):
+        """Forward the end of ``job`` to its channel (service thread)."""
+        channel = self.job_rows[id(job)][3]
+        if job.state == JOB_FAILED:
+            channel.fail(job.error)
+        else:
+            channel.finish(job)
+
+    def poll_queue(self):
+        """Drain every job channel and refresh the job rows once."""
+        for job in self.jobs:
+            if id(job) in self.finished_jobs:
+                continue
+            _, progress_bar, status, channel = self.job_rows[id(job)]
+            event = channel.drain()
+            if event is None:
+                if channel.total:
+                    progress_bar.set(channel.done / channel.total)
+                    status.configure(text=channel.status_text())
+                continue
+            self.finished_jobs.add(id(job))
+            if event[0] == "finished":
+                progress_bar.set(1)
+                status.configure(text=f"完了: {job.output_path}", text_color="green")
+            else:
+                status.configure(text=f"失敗: {event[1]}", text_color="red")
+        finished = len(self.finished_jobs)
+        scheduler = self.analyzer.scheduler
+        self.queue_status_label.configure(
+            text=f"{finished}/{len(self.jobs)}件完了 処理中 {scheduler.in_flight} "
+            f"エラー {scheduler.failures - self.failures_before}{self.cache_status()}"
+        )
+        if not self.queue_future.done():
+            self.after(PROGRESS_INTERVAL_MS, self.poll_queue)
+        else:
+            self.finish_queue()
+
+    def finish_queue(self):
+        """Write the run report of the queue and re-enable the buttons."""
+        if self.queue_future.exception() is not None:
+            messagebox.showerror("分析エラー", str(self.queue_future.exception()))
+        failed = sum(job.state == JOB_FAILED for job in self.jobs)
+        self.metrics.finish(sum(job.total or 0 for job in self.jobs if job.state != JOB_FAILED))
+        self.write_report(self.jobs[0].input_path)
+        self.queue_status_label.configure(
+            text=f"{len(self.jobs) - failed}/{len(self.jobs)}件のジョブが完了しました{self.cache_status()}\n"
+            f"{self.metrics.summary_text()}",
+            text_color="red" if failed else "green",
+        )
+        for job in self.jobs:
+            self.job_rows[id(job)][0].configure(state="normal")
+        self.queue_add_button.configure(state="normal")
+        self.queue_clear_button.configure(state="normal")
+        self.queue_run_button.configure(state="normal")
+        self.upload_button.configure(state="normal")
+        self.resume_button.configure(state="normal")
+        if self.df is not None:
+            self.analyze_button.configure(state="normal")
+
     def load_excel_file(self):
-        """Open an Excel file and populate the column selector."""
-        file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
+        """Open an Excel, Parquet, CSV or JSONL file and populate the column selector."""
+        file_path = filedialog.askopenfilename(filetypes=file_types())
         if not file_path:
             return
+        self.read_input_file(file_path)
+
+    def read_input_file(self, file_path: str) -> bool:
+        """Load ``file_path`` into ``self.df``.
+
+        Returns
+        -------
+        bool
+            ``True`` if the file was read successfully.
+        """
         try:
-            self.df = pd.read_excel(file_path, sheet_name=0)
+            self.df = read_table(file_path)
+            self.file_path = file_path
+            self.score_matrix = None
             self.column_combo.configure(values=list(self.df.columns))
-            if self.df.columns:
+            if len(self.df.columns):
                 self.column_combo.set(self.df.columns[0])
             self.status_label.configure(text=f"ファイルを読み込みました: {len(self.df)}件")
             self.update_weight_info()
+            return True
         except Exception as e:
             self.status_label.configure(text="ファイルの読み込みに失敗", text_color="red")
             messagebox.showerror("読み込みエラー", str(e))
+            return False
+
+    def resume_analysis(self):
+        """Reload an input file and continue its interrupted run."""
+        file_path = filedialog.askopenfilename(filetypes=file_types())
+        if not file_path:
+            return
+        journal = RunJournal(RunJournal.path_for(file_path))
+        if not journal.exists():
+            messagebox.showinfo("再開", "このファイルの中断された分析は見つかりません")
+            return
+        if not self.read_input_file(file_path):
+            return
+        header, _ = journal.load()
+        if header is None or header.get("rows") != len(self.df) or header.get("column") not in self.df.columns:
+            messagebox.showerror("再開エラー", "ファイルの内容が中断時と一致しません")
+            return
+        self.column_combo.set(header["column"])
+        self.start_analysis(resume=True)
 
     def validate_parameters(self):
-        """Validate temperature and top-p entries.
+        """Validate the numeric entries of the settings tab.
 
         Returns
         -------
         bool
-            ``True`` if both values can be converted to ``float``.
+            ``True`` if temperature and top-p are numbers, the
+            concurrency and batch sizes are positive integers and the
+            weights sum to at most 1.
         """
         try:
             self.temperature = float(self.temp_entry.get())
             self.top_p = float(self.top_p_entry.get())
-            self.config.set_temperature(self.temperature)
-            self.config.set_top_p(self.top_p)
-            return True
+            concurrency = int(self.concurrency_entry.get())
+            batch_size = int(self.batch_size_entry.get())
+            score_batch_size = int(self.score_batch_entry.get())
+            reason_threshold = int(self.reason_threshold_entry.get())
+            similarity = float(self.similarity_entry.get())
         except ValueError:
             messagebox.showerror("エラー", "数値を入力してください")
             return False
+        if concurrency < 1 or batch_size < 1 or score_batch_size < 1:
+            messagebox.showerror("エラー", "同時実行数と一括件数は1以上の整数を入力してください")
+            return False
+        if not 0 < similarity <= 1:
+            messagebox.showerror("エラー", "類似度しきい値は0より大きく1以下の数値を入力してください")
+            return False
+        if sum(slider.get() for slider in self.weight_sliders.values()) > 1.0:
+            messagebox.showerror("エラー", "重みの合計が1を超えています")
+            return False
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.score_batch_size = score_batch_size
+        self.reason_threshold = reason_threshold
+        self.config.set_temperature(self.temperature)
+        self.config.set_top_p(self.top_p)
+        self.config.set_concurrency(self.concurrency)
+        self.config.set_moderation_batch_size(self.batch_size)
+        self.config.set_score_batch_size(self.score_batch_size)
+        self.config.set_score_mode(SCORE_MODE_SCORE_ONLY if self.score_only_var.get() else SCORE_MODE_FULL)
+        self.config.set_reason_threshold(self.reason_threshold)
+        self.config.set_cascade_enabled(self.cascade_var.get())
+        self.analyzer.cascade = None
+        if self.cascade_var.get():
+            self.analyzer.cascade = CascadePolicy.from_settings(self.config.get_cascade_settings())
+        self.config.set_prefilter_enabled(self.prefilter_var.get())
+        self.analyzer.prefilter = None
+        if self.prefilter_var.get():
+            if self.prefilter is None:
+                try:
+                    self.prefilter = Prefilter.from_settings(self.config.get_prefilter_settings())
+                except OSError as e:
+                    messagebox.showerror("エラー", f"リスク語リストが見つかりません: {e.filename or e}")
+                    return False
+            self.analyzer.prefilter = self.prefilter
+        self.config.set_neardup_enabled(self.neardup_var.get())
+        self.config.set_neardup_threshold(similarity)
+        self.analyzer.near_duplicates = None
+        if self.neardup_var.get():
+            from neardup import NearDuplicateIndex
+
+            self.analyzer.near_duplicates = NearDuplicateIndex.from_settings(self.config.get_neardup_settings())
+        backend = self.backend_combo.get()
+        if backend != BACKEND_LOCAL and self.analyzer.client is None:
+            messagebox.showerror("エラー", "OpenAI APIキーが設定されていないため、ローカルモデルのみ使用できます")
+            return False
+        self.config.set_backend(backend)
+        self.analyzer.local_backend = None
+        if backend != BACKEND_OPENAI:
+            from local_model import LocalBackend
+
+            try:
+                self.analyzer.local_backend = LocalBackend.from_settings(self.config.get_local_model_settings())
+            except OSError as e:
+                messagebox.showerror("エラー", f"ローカルモデルを読み込めません: {e}")
+                return False
+        return True
+
+    def ensure_service(self) -> bool:
+        """Create the analysis service on first use.
+
+        Building the analyzer imports openai and opens the cache, so it is
+        deferred until an analysis is actually started.
+
+        Returns
+        -------
+        bool
+            ``True`` if the service is running.
+        """
+        if self.service is not None:
+            return True
+        from service import AnalysisService
+
+        # the analyzer only needs an API key when the chosen backend uses OpenAI
+        self.config.set_backend(self.backend_combo.get())
+        try:
+            self.service = AnalysisService(self.config)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("エラー", str(e))
+            return False
+        self.analyzer = self.service.analyzer
+        self.prefilter = self.prefilter or self.analyzer.prefilter
+        return True
 
     def on_weight_change(self, key: str, value: float):
         """Redistribute weights so that the total remains 1.0."""
@@ -143,6 +500,18 @@ class ModerationApp(ctk.CTk):
         finally:
             self.updating_weights = False
             self.update_weight_info()
+            self.rescore()
+
+    def rescore(self):
+        """Recompute ``total_aggression`` from the current slider values.
+
+        Only rows that were already analyzed are re-scored; no API calls
+        are made.
+        """
+        if self.score_matrix is None:
+            return
+        weights = {k: slider.get() for k, slider in self.weight_sliders.items()}
+        self.apply_total_score(weights)
 
     def update_weight_info(self):
         """Update remaining-weight display and button states."""
@@ -157,87 +526,174 @@ class ModerationApp(ctk.CTk):
             if self.df is not None:
                 self.analyze_button.configure(state="normal")
 
-    def start_analysis(self):
-        """Begin analysis of the loaded file in a worker thread."""
-        if not self.validate_parameters():
+    def start_analysis(self, resume: bool = False):
+        """Submit analysis of the loaded file to the analysis service.
+
+        With ``resume`` the rows recorded in the file's journal are skipped.
+        The job reports through a ``ProgressChannel`` that the main loop
+        polls every ``PROGRESS_INTERVAL_MS``.
+        """
+        if not self.ensure_service() or not self.validate_parameters():
             return
         self.analyze_button.configure(state="disabled")
         self.upload_button.configure(state="disabled")
-        threading.Thread(target=lambda: asyncio.run(self.analyze_file_async())).start()
-
-    async def analyze_file_async(self):
-        """Run moderation on each row of ``self.df`` asynchronously."""
-        column = self.column_combo.get()
-        category_names = ["hate", "hate/threatening", "self-harm", "sexual",
-                          "sexual/minors", "violence", "violence/graphic"]
-        category_flags = {name: [] for name in category_names}
-        category_scores = {name: [] for name in category_names}
-        ag_scores = []
-        ag_reasons = []
-        total_rows = len(self.df)
-
-        for idx, row in self.df.iterrows():
-            text = row[column]
-            cats, scores = await self.analyzer.moderate_text(text)
-            if cats is None or scores is None:
-                for name in category_names:
-                    category_flags[name].append(False)
-                    category_scores[name].append(0.0)
-            else:
-                for name in category_names:
-                    category_flags[name].append(getattr(cats, name.replace("/", "_"), False))
-                    category_scores[name].append(getattr(scores, name.replace("/", "_"), 0.0))
-            score, reason = await self.analyzer.get_aggressiveness_score(text, self.temperature, self.top_p)
-            ag_scores.append(score)
-            ag_reasons.append(reason)
-
-            progress = (idx + 1) / total_rows
-            self.progress_bar.set(progress)
-            self.status_label.configure(text=f"分析中... {idx + 1}/{total_rows}")
-
-        for name in category_names:
-            self.df[f"{name}_flag"] = category_flags[name]
-            self.df[f"{name}_score"] = category_scores[name]
-        self.df["aggressiveness_score"] = ag_scores
-        self.df["aggressiveness_reason"] = ag_reasons
+        self.resume_button.configure(state="disabled")
+        self.queue_run_button.configure(state="disabled")
+        self.progress_bar.set(0)
+        self.status_label.configure(text="分析中...", text_color="white")
+        self.progress = ProgressChannel()
+        self.failures_before = self.analyzer.scheduler.failures
+        self.metrics = self.analyzer.start_metrics(self.config.get_metrics_settings()["prices"])
+        future = self.service.submit(self.analyze_file_async(
+            self.progress,
+            self.column_combo.get(),
+            AnalysisOptions.from_config(self.config),
+            resume,
+        ))
+        future.add_done_callback(lambda f, channel=self.progress: self.post_outcome(f, channel))
+        self.after(PROGRESS_INTERVAL_MS, self.poll_progress)
+
+    @staticmethod
+    def post_outcome(future, channel: ProgressChannel):
+        """Forward the result or exception of a finished job to ``channel``."""
+        if future.cancelled():
+            channel.fail(RuntimeError("分析が中断されました"))
+        elif future.exception() is not None:
+            channel.fail(future.exception())
+        else:
+            channel.finish(future.result())
+
+    async def analyze_file_async(self, channel: ProgressChannel, column: str, options: AnalysisOptions,
+                                 resume: bool = False):
+        """Run moderation on ``column`` of ``self.df`` asynchronously.
+
+        Runs on the service's loop thread and must not touch any widget, so
+        the column and options are read on the Tk thread by the caller;
+        progress goes to ``channel``.
+        """
+        texts = self.df[column].tolist()
+        journal = RunJournal(RunJournal.path_for(self.file_path))
+        completed = {}
+        if resume and journal.exists():
+            _, completed = journal.load()
+        journal.start({"input": self.file_path, "column": column, "rows": len(texts)}, resume)
+        try:
+            return await analyze_rows(
+                self.analyzer,
+                texts,
+                options,
+                channel.report,
+                journal,
+                completed,
+            )
+        finally:
+            journal.close()
+
+    def poll_progress(self):
+        """Drain the progress channel and refresh the progress widgets once."""
+        event = self.progress.drain()
+        if self.progress.total:
+            self.progress_bar.set(self.progress.done / self.progress.total)
+        scheduler = self.analyzer.scheduler
+        self.status_label.configure(
+            text=self.progress.status_text(scheduler.in_flight, scheduler.failures - self.failures_before)
+            + self.cache_status()
+        )
+        if event is None:
+            self.after(PROGRESS_INTERVAL_MS, self.poll_progress)
+        elif event[0] == "finished":
+            self.finish_analysis(event[1])
+        else:
+            self.status_label.configure(text="分析に失敗しました", text_color="red")
+            messagebox.showerror("分析エラー", str(event[1]))
+            self.enable_buttons()
+
+    def finish_analysis(self, results):
+        """Store the results of a finished run and update the UI."""
+        from scoring import build_score_matrix
+
+        self.df = results.attach(self.df)
+        self.score_matrix = build_score_matrix(self.df)
 
         weights = {k: slider.get() for k, slider in self.weight_sliders.items()}
         self.config.data["weights"] = weights
         self.config.set_temperature(self.temperature)
         self.config.set_top_p(self.top_p)
+        self.config.set_concurrency(self.concurrency)
+        self.config.set_moderation_batch_size(self.batch_size)
+        self.config.set_score_batch_size(self.score_batch_size)
         self.config.save()
         self.apply_total_score(weights)
-        self.status_label.configure(text="分析が完了しました", text_color="green")
+        self.progress_bar.set(1)
+        self.metrics.finish(results.size)
+        self.write_report()
+        self.status_label.configure(
+            text=f"分析が完了しました {results.dedup_text()}{self.cache_status()}\n{self.metrics.summary_text()}",
+            text_color="green",
+        )
         self.save_button.configure(state="normal")
+        self.enable_buttons()
+
+    def write_report(self, input_path: str = None):
+        """Write the run report (and Prometheus file if configured) next to other reports.
+
+        The report is named after ``input_path``, by default the loaded file.
+        """
+        settings = self.config.get_metrics_settings()
+        path = report_path(input_path or self.file_path, settings["report_dir"], ".json")
+        try:
+            self.metrics.write_json(path)
+            if settings["prometheus"]:
+                self.metrics.write_prometheus(path[:-len(".json")] + ".prom")
+        except OSError as e:
+            messagebox.showerror("レポートエラー", str(e))
+
+    def enable_buttons(self):
+        """Re-enable the buttons disabled while an analysis runs."""
         self.upload_button.configure(state="normal")
+        self.resume_button.configure(state="normal")
         self.analyze_button.configure(state="normal")
+        if self.jobs:
+            self.queue_run_button.configure(state="normal")
+
+    def cache_status(self) -> str:
+        """Return the cache, prefilter, near-duplicate and local model suffix for the status label."""
+        parts = []
+        if self.analyzer is None:
+            return ""
+        if self.analyzer.cache is not None:
+            parts.append(self.analyzer.cache.stats_text())
+        if self.analyzer.prefilter is not None:
+            parts.append(self.analyzer.prefilter.stats_text())
+        if self.analyzer.near_duplicates is not None:
+            parts.append(self.analyzer.near_duplicates.stats_text())
+        if self.analyzer.local_backend is not None:
+            parts.append(self.analyzer.local_backend.stats_text())
+        return f" ({' / '.join(parts)})" if parts else ""
 
     def apply_total_score(self, weights):
-        """Calculate a weighted aggression score for each row."""
-        def calc(row):
-            val = 0.0
-            val += weights.get("hate_score", 0) * row.get("hate_score", 0)
-            val += weights.get("hate/threatening_score", 0) * row.get("hate/threatening_score", 0)
-            val += weights.get("violence_score", 0) * row.get("violence_score", 0)
-            val += weights.get("sexual_score", 0) * row.get("sexual_score", 0)
-            val += weights.get("sexual/minors_score", 0) * row.get("sexual/minors_score", 0)
-            ag = row.get("aggressiveness_score") or 0
-            val += weights.get("aggressiveness_score", 0) * ag
-            val += weights.get("flag_hate", 0) * (1 if row.get("hate_flag") else 0)
-            val += weights.get("flag_hate/threatening", 0) * (1 if row.get("hate/threatening_flag") else 0)
-            val += weights.get("flag_violence", 0) * (1 if row.get("violence_flag") else 0)
-            val += weights.get("flag_sexual", 0) * (1 if row.get("sexual_flag") else 0)
-            return val
-
-        self.df["total_aggression"] = self.df.apply(calc, axis=1)
+        """Calculate a weighted aggression score for each row.
+
+        The score/flag matrix is built once per analysis run, so later
+        calls only cost a single matrix-vector product.
+        """
+        from scoring import build_score_matrix, total_score
+
+        if self.score_matrix is None:
+            self.score_matrix = build_score_matrix(self.df)
+        self.df["total_aggression"] = total_score(self.score_matrix, weights)
 
     def save_results(self):
-        """Save the processed DataFrame to a new Excel file."""
-        save_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
+        """Save the processed DataFrame; the format follows the chosen extension.
+
+        Excel is the default for handing results over; Parquet keeps typed
+        columns and is much faster for large files.
+        """
+        save_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=file_types())
         if not save_path:
             return
         try:
-            self.df.to_excel(save_path, index=False)
+            write_table(self.df, save_path)
             self.status_label.configure(text="結果を保存しました", text_color="green")
         except Exception as e:
             self.status_label.configure(text="保存に失敗しました", text_color="red")